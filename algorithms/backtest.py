@@ -0,0 +1,190 @@
+"""
+Rolling-origin backtest of the forecast models, fully offline.
+
+Replays recorded daily history (the parquet files of the history store, or any
+directory of <TICKER>.parquet fixtures) through statsforecast's
+cross_validation for every ticker x model x frame x setting, in parallel worker
+processes. Reports accuracy (MAE, RMSE, MAPE) alongside fit+predict wall time
+and peak memory, so defaults can be picked on measured numbers:
+
+    python -m algorithms.backtest --frames week,month --season-lengths 5,7
+"""
+
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+sys.path.append("..")
+import config as CONFIG
+
+# reuse the bot's compiled statsforecast kernels, like algorithms/singleline.py
+os.environ.setdefault("NIXTLA_NUMBA_CACHE", "1")
+os.environ.setdefault("NUMBA_CACHE_DIR", CONFIG.NUMBA_CACHE_DIR)
+
+# the live models and frames (see algorithms/singleline.py), by name so this
+# module stays light to import; statsforecast is only loaded in the workers
+frame_nums = {"day": 1, "week": 7, "month": 30, "year": 365}
+MODELS = {
+    "arima": "AutoARIMA",
+    "ets": "AutoETS",
+    "ces": "AutoCES",
+    "theta": "AutoTheta",
+}
+
+
+def load_fixture(path, col):
+    y = pd.read_parquet(path, columns=[col])[col]
+    y = y[y != 0].dropna()
+    # the live models see consecutive bars as consecutive days (freq="D"), do the same
+    return pd.DataFrame(
+        {
+            "unique_id": os.path.splitext(os.path.basename(path))[0],
+            "ds": pd.date_range("2000-01-01", periods=len(y), freq="D"),
+            "y": y.to_numpy(),
+        }
+    )
+
+
+def default_input_size(frame):
+    # the rule singleline uses for how much history each fit gets
+    num_days = frame_nums[frame]
+    return 14 if num_days <= 14 else num_days * 2
+
+
+def run_case(path, col, model, frame, season_length, input_size, n_windows):
+    import statsforecast.models
+    from statsforecast import StatsForecast
+
+    df = load_fixture(path, col)
+    h = frame_nums[frame]
+    case = {
+        "ticker": df["unique_id"].iloc[0] if len(df) else os.path.basename(path),
+        "model": model,
+        "frame": frame,
+        "season_length": season_length,
+        "input_size": input_size,
+    }
+    if len(df) < input_size + h * n_windows:
+        return dict(case, error="not enough history")
+
+    model_class = getattr(statsforecast.models, MODELS[model])
+    sf = StatsForecast(models=[model_class(season_length=season_length)], freq="D")
+    alias = sf.models[0].alias
+    # one untimed fit first, so numba compiling (or loading its cache) isn't counted
+    sf.forecast(df=df.head(input_size), h=h)
+
+    def cross_validation():
+        return sf.cross_validation(
+            df=df, h=h, step_size=h, n_windows=n_windows, input_size=input_size
+        )
+
+    started = time.perf_counter()
+    try:
+        cv = cross_validation()
+    except Exception as e:
+        return dict(case, error=repr(e))
+    elapsed = time.perf_counter() - started
+    # peak memory from a second, traced pass, tracing would skew the timed one
+    tracemalloc.start()
+    try:
+        cross_validation()
+        peak = tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+    error = cv[alias].to_numpy() - cv["y"].to_numpy()
+    return dict(
+        case,
+        mae=np.mean(np.abs(error)),
+        rmse=np.sqrt(np.mean(error**2)),
+        mape=np.mean(np.abs(error / cv["y"].to_numpy())) * 100,
+        seconds_per_fit=elapsed / n_windows,
+        peak_kb=peak,
+        error=None,
+    )
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--fixtures", default=CONFIG.HISTORY_DIR)
+    parser.add_argument("--tickers", help="comma separated, defaults to every fixture")
+    parser.add_argument("--col", default="Close")
+    parser.add_argument("--models", default=",".join(MODELS))
+    parser.add_argument("--frames", default="week,month")
+    parser.add_argument("--season-lengths", default="7")
+    parser.add_argument(
+        "--input-sizes", help="comma separated, defaults to the live rule per frame"
+    )
+    parser.add_argument("--windows", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    paths = sorted(glob.glob(os.path.join(args.fixtures, "*.parquet")))
+    if args.tickers:
+        wanted = {ticker.upper() for ticker in args.tickers.split(",")}
+        paths = [p for p in paths if os.path.basename(p)[: -len(".parquet")] in wanted]
+    if not paths:
+        sys.exit(f"No fixtures found in {args.fixtures}")
+
+    cases = []
+    for frame in args.frames.split(","):
+        input_sizes = (
+            [int(size) for size in args.input_sizes.split(",")]
+            if args.input_sizes
+            else [default_input_size(frame)]
+        )
+        for path in paths:
+            for model in args.models.split(","):
+                for season_length in args.season_lengths.split(","):
+                    for input_size in input_sizes:
+                        cases.append(
+                            (
+                                path,
+                                args.col,
+                                model,
+                                frame,
+                                int(season_length),
+                                input_size,
+                                args.windows,
+                            )
+                        )
+
+    with ProcessPoolExecutor(
+        args.workers, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        results = pd.DataFrame(pool.map(run_case, *zip(*cases)))
+
+    failed = results[results["error"].notna()]
+    if not failed.empty:
+        print(f"{len(failed)} cases skipped:")
+        print(failed[["ticker", "model", "frame", "error"]].to_markdown(index=False))
+    done = results[results["error"].isna()]
+    summary = (
+        done.groupby(["frame", "model", "season_length", "input_size"])[
+            ["mae", "rmse", "mape", "seconds_per_fit", "peak_kb"]
+        ]
+        .mean()
+        .sort_values(["frame", "mape"])
+    )
+    print(summary.round(4).to_markdown())
+
+    output = args.output or f"data/backtest_{pd.Timestamp.today().date()}.csv"
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    results.to_csv(output, index=False)
+    print(f"Saved {len(results)} cases to {output}")
+
+
+if __name__ == "__main__":
+    main()
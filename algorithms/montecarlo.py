@@ -1,118 +1,265 @@
 import numpy as np
 import pandas as pd
-from random import random
-import matplotlib.pyplot as plt
-from scipy.stats import norm
 import sys
+from scipy.stats import norm, qmc
 
 sys.path.append("..")
 import discord_actions.actions as ac
+import discord_actions.render as render
 
+frame_nums = {"day": 1, "week": 7, "month": 30, "year": 365}
+# number of simulated paths
+SIMS = 10000
+# independently scrambled Sobol sequences, their spread gives the standard error
+REPLICATES = 8
+# "plain" pseudo-random shocks, "antithetic" pairs (z, -z) or scrambled "sobol" points
+METHOD = "antithetic"
+# days x paths simulated at a time by stream() (4 MB per float64 array), memory
+# stays the same for any number of paths and any frame
+CHUNK_ELEMENTS = 2**19
+# stream() keeps one histogram of log growth per day instead of the paths, with
+# BINS bins spanning SPREAD standard deviations either side of the expected growth
+BINS = 1000
+SPREAD = 8
+PERCENTILES = (5, 25, 50, 75, 95)
+# confidence of the value at risk and expected shortfall
+LEVEL = 0.95
 
-def monte_carlo(ticker, frame="week", col="Close"):
-    frame_nums = {"day": 1, "week": 7, "month": 30, "year": 365}
+
+def _normals(days_to_sim, sims, method, rng):
+    # (sims, days) standard normal shocks, laid out the way _estimate expects
+    if method == "antithetic":
+        z = rng.standard_normal((-(-sims // 2), days_to_sim))
+        return np.concatenate([z, -z])
+    if method == "sobol":
+        # powers of two keep the sequence balanced, so sims is rounded to one
+        m = int(np.round(np.log2(max(sims / REPLICATES, 1))))
+        points = [
+            qmc.Sobol(days_to_sim, seed=rng).random_base2(m) for _ in range(REPLICATES)
+        ]
+        return norm.ppf(np.concatenate(points))
+    return rng.standard_normal((sims, days_to_sim))
+
+
+def simulate(price, avg, stdev, days_to_sim, sims=SIMS, seed=None, method=METHOD):
+    # draw every daily shock at once, one row per path
+    rng = np.random.default_rng(seed)
+    shocks = avg + stdev * _normals(days_to_sim, sims, method, rng)
+    paths = np.empty((len(shocks), days_to_sim + 1))
+    paths[:, 0] = price
+    np.cumprod(1 + shocks, axis=1, out=paths[:, 1:])
+    paths[:, 1:] *= price
+    return paths
+
+
+def _estimate(values, method):
+    # mean and its standard error, from the independent units of each method:
+    # single paths, antithetic pairs or whole Sobol replicates
+    if method == "antithetic":
+        units = (values[: len(values) // 2] + values[len(values) // 2 :]) / 2
+    elif method == "sobol":
+        units = values.reshape(REPLICATES, -1).mean(axis=1)
+    else:
+        units = values
+    return float(units.mean()), float(units.std(ddof=1) / np.sqrt(len(units)))
+
+
+def _summarize(paths, last_price, method=METHOD):
+    # (estimate, standard error) of the closing price, its change and the chance of increase
+    end = paths[:, -1]
+    avg_price, price_se = _estimate(end, method)
+    increase = _estimate((end > last_price).astype(float), method)
+    change = ((avg_price - last_price) / last_price, price_se / last_price)
+    return (avg_price, price_se), change, increase
+
+
+def _combine(estimates, weights):
+    # mean and standard error of independent chunk estimates
+    values, errors = np.array(estimates).T
+    return float(weights @ values), float(np.sqrt((weights**2) @ (errors**2)))
+
+
+def _quantiles(counts, lo, width, q):
+    # interpolated q quantile of every day's histogram, in log growth
+    cdf = counts.cumsum(axis=1) / counts.sum(axis=1, keepdims=True)
+    i = np.minimum((cdf < q).sum(axis=1), counts.shape[1] - 1)
+    rows = np.arange(len(counts))
+    below = np.where(i > 0, cdf[rows, i - 1], 0.0)
+    frac = (q - below) / np.maximum(cdf[rows, i] - below, 1e-12)
+    return lo + (i + np.clip(frac, 0, 1)) * width, i, frac
+
+
+def stream(price, avg, stdev, days_to_sim, sims=SIMS, seed=None, method=METHOD):
+    # estimates, percentile bands and tail risk of sims paths, simulated
+    # CHUNK_ELEMENTS at a time and reduced to fixed size histograms, so a million
+    # paths fit in the same memory as a few thousand
+    rng = np.random.default_rng(seed)
+    day = np.arange(1, days_to_sim + 1)
+    half = SPREAD * max(stdev, 1e-9) * np.sqrt(day)
+    lo = day * np.log1p(avg) - half
+    width = 2 * half / BINS
+    offsets = np.arange(days_to_sim) * BINS
+
+    counts = np.zeros(days_to_sim * BINS)
+    # sum of the closes in each bin of the last day, for the expected shortfall
+    end_sums = np.zeros(BINS)
+    estimates, sizes = [], []
+    chunk = max(1, CHUNK_ELEMENTS // days_to_sim)
+    done = 0
+    while done < sims:
+        paths = simulate(
+            price, avg, stdev, days_to_sim, min(chunk, sims - done), rng, method
+        )
+        growth = np.log(np.maximum(paths[:, 1:], 1e-12) / price)
+        bins = np.clip(((growth - lo) / width).astype(int), 0, BINS - 1)
+        counts += np.bincount((bins + offsets).ravel(), minlength=counts.size)
+        end_sums += np.bincount(bins[:, -1], weights=paths[:, -1], minlength=BINS)
+        estimates.append(_summarize(paths, price, method))
+        sizes.append(len(paths))
+        done += len(paths)
+    counts = counts.reshape(days_to_sim, BINS)
+    weights = np.array(sizes) / sum(sizes)
+
+    bands = {}
+    for p in PERCENTILES:
+        growth, _, _ = _quantiles(counts, lo, width, p / 100)
+        bands[p] = price * np.exp(np.concatenate([[0.0], growth]))
+
+    # the worst 1 - LEVEL of closes: the value at risk is where they start,
+    # the expected shortfall their average, both as a loss of the current price
+    tail = 1 - LEVEL
+    growth, i, frac = _quantiles(counts[-1:], lo[-1:], width[-1:], tail)
+    i, frac = i[0], frac[0]
+    shortfall = (end_sums[:i].sum() + frac * end_sums[i]) / (tail * sum(sizes))
+    return {
+        "close": _combine([e[0] for e in estimates], weights),
+        "change": _combine([e[1] for e in estimates], weights),
+        "increase": _combine([e[2] for e in estimates], weights),
+        "bands": bands,
+        "var": float(1 - np.exp(growth[0])),
+        "cvar": float(1 - shortfall / price),
+    }
+
+
+def _closed_form(avg, stdev, days_to_sim):
+    # expected growth and chance of a rise, elementwise: the daily growth
+    # 1 + N(avg, stdev) is matched by a log-normal with the same mean and
+    # variance, which makes the close log-normal too (geometric Brownian motion)
+    growth = 1 + avg
+    sigma2 = np.log1p((stdev / growth) ** 2)
+    mu = np.log(growth) - sigma2 / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = mu * np.sqrt(days_to_sim) / np.sqrt(sigma2)
+    # without volatility the close only rises if the drift does
+    increase_chance = np.where(sigma2 > 0, norm.cdf(z), mu > 0)
+    return growth**days_to_sim, increase_chance
+
+
+def _format(estimate, percent=False):
+    value, se = estimate
+    if percent:
+        return f"{round(value * 100, 2)}% ± {round(se * 100, 2)}%"
+    return f"{round(value, 2)} ± {round(se, 2)}"
+
+
+def fetch(ticker, frame="week", col="Close", sims=SIMS, method=METHOD, history=None):
+    # the I/O half of monte_carlo, run on the thread pool by the scheduler
     start_date = pd.to_datetime("today") - pd.Timedelta(frame_nums[frame], unit="D")
     end_date = pd.to_datetime("today")
     hist = ac.get_history(ticker, start=start_date, end=end_date)
-    days = [i for i in range(1, len(hist[col]) + 1)]
-    price_orig = hist[col].tolist()
-    change = hist[col].pct_change().tolist()
-    change = change[1:]
+    price_orig = hist[col].to_numpy()
+    change = hist[col].pct_change().to_numpy()[1:]
+    return {"history": (start_date, price_orig, change)}
+
+
+def monte_carlo(
+    ticker, frame="week", col="Close", sims=SIMS, method=METHOD, history=None
+):
+    if history is None:
+        history = fetch(ticker, frame, col)["history"]
+    start_date, price_orig, change = history
+    days = np.arange(1, len(price_orig) + 1)
 
     # Stats for model
     avg = np.mean(change)
     stdev = np.std(change)
-    sims = 200
     days_to_sim = frame_nums[frame]
 
     days = days[-(frame_nums[frame] * 2) :]
     price_orig = price_orig[-(frame_nums[frame] * 2) :]
-    fig = plt.figure()
-    plt.plot(days, price_orig)
-    plt.title(f"Monte Carlo: {ticker}")
-    plt.xlabel(f"Trading Days After {start_date}")
-    plt.ylabel(f"{col} Price($)")
-    plt.grid()
-
-    end = []
-    above = []
-
-    for i in range(sims):
-        num_days = [days[-1]]
-        price = [price_orig[-1]]
-        for j in range(days_to_sim):
-            num_days.append(num_days[-1] + 1)
-            percent_change = norm.ppf(random(), loc=avg, scale=stdev)
-            price.append(price[-1] * (1 + percent_change))
-
-        if price[-1] > price_orig[-1]:
-            above.append(1)
-        else:
-            above.append(0)
-        end.append(price[-1])
-        plt.plot(num_days, price)
-
-    avg_price = sum(end) / sims
-    avg_perc_change = (avg_price - price_orig[-1]) / price_orig[-1]
-    increase_chance = sum(above) / sims
+
+    risk = stream(price_orig[-1], avg, stdev, days_to_sim, sims, method=method)
+    num_days = np.arange(days[-1], days[-1] + days_to_sim + 1)
+    bands = risk["bands"]
+    # a fan of percentile bands around the median instead of individual paths
+    png = render.draw(
+        render.line_chart,
+        [(days, price_orig), (num_days, bands[50])],
+        f"Monte Carlo: {ticker}",
+        f"Trading Days After {start_date}",
+        f"{col} Price($)",
+        labels=["History", "Median"],
+        bands=[(1, num_days, bands[5], bands[95]), (1, num_days, bands[25], bands[75])],
+    )
 
     text = pd.DataFrame.from_dict(
         {
-            "Closing": str(round(avg_price, 2)),
-            "Percent Change": str(round(avg_perc_change * 100, 2)) + "%",
-            "Chance of Increase": str(round(increase_chance * 100, 2)) + "%",
+            "Closing": _format(risk["close"]),
+            "Percent Change": _format(risk["change"], percent=True),
+            "Chance of Increase": _format(risk["increase"], percent=True),
+            f"Value at Risk ({LEVEL:.0%})": f"{round(risk['var'] * 100, 2)}%",
+            f"Expected Shortfall ({LEVEL:.0%})": f"{round(risk['cvar'] * 100, 2)}%",
+            "5th-95th Percentile": f"{round(bands[5][-1], 2)} - {round(bands[95][-1], 2)}",
         },
         orient="index",
     )
-    return [fig, text]
+    return [png, text]
 
 
-def fast_monte_carlo(ticker, frame="week", col="Close"):
-    frame_nums = {"day": 1, "week": 7, "month": 30, "year": 365}
+def fetch_bulk(tickers, frame="week", col="Close", prices=None):
+    # the I/O half of bulk_monte_carlo, one download for every ticker
+    tickers = [ticker for ticker in tickers if ticker]
     start_date = pd.to_datetime("today") - pd.Timedelta(frame_nums[frame], unit="D")
     end_date = pd.to_datetime("today")
-    hist = ac.get_history(ticker, start=start_date, end=end_date)
-    days = [i for i in range(1, len(hist[col]) + 1)]
-    price_orig = hist[col].tolist()
-    change = hist[col].pct_change().tolist()
-    change = change[1:]
+    hist = ac.get_history_bulk(tickers, start=start_date, end=end_date)
+    if isinstance(hist.columns, pd.MultiIndex):
+        prices = hist[col]
+    else:
+        prices = hist[[col]].set_axis(tickers[:1], axis=1)
+    return {"prices": prices.reindex(columns=tickers).dropna(axis=1, how="all")}
 
-    # Stats for model
-    avg = np.mean(change)
-    stdev = np.std(change)
-    sims = 200
+
+def bulk_monte_carlo(tickers, frame="week", col="Close", prices=None):
+    if prices is None:
+        prices = fetch_bulk(tickers, frame, col)["prices"]
+
+    # Stats for model, one entry per ticker
+    change = prices.pct_change(fill_method=None)
+    avg = change.mean().to_numpy()
+    stdev = change.std(ddof=0).to_numpy()
+    valid = ~(np.isnan(avg) | np.isnan(stdev))
     days_to_sim = frame_nums[frame]
 
-    days = days[-(frame_nums[frame] * 2):]
-    price_orig = price_orig[-(frame_nums[frame] * 2):]
-
-    end = []
-    above = []
-
-    for i in range(sims):
-        num_days = [days[-1]]
-        price = [price_orig[-1]]
-        for j in range(days_to_sim):
-            num_days.append(num_days[-1] + 1)
-            percent_change = norm.ppf(random(), loc=avg, scale=stdev)
-            price.append(price[-1] * (1 + percent_change))
-
-        if price[-1] > price_orig[-1]:
-            above.append(1)
-        else:
-            above.append(0)
-        end.append(price[-1])
-    avg_price = sum(end) / sims
-    avg_perc_change = (avg_price - price_orig[-1]) / price_orig[-1]
-    increase_chance = sum(above) / sims
+    # only the terminal distribution is ranked, so every ticker gets the closed
+    # form at once: cheaper than simulating paths and free of sampling error
+    growth, increase_chance = _closed_form(avg[valid], stdev[valid], days_to_sim)
+    perc_change = np.round((growth - 1) * 100, 2)
+    increase = np.round(increase_chance * 100, 2)
+    scores = pd.Series(
+        np.round(perc_change * increase / 100, 2),
+        index=prices.columns[valid],
+        name="Relevancy Score",
+    )
+    return scores.sort_values(ascending=False)
 
-    return {
-        "%change": round(avg_perc_change * 100, 2),
-        "increase": round(increase_chance * 100, 2),
-    }
+
+# fetched on the I/O lane before the simulation goes to the CPU lane
+monte_carlo.prepare = fetch
+bulk_monte_carlo.prepare = fetch_bulk
 
 
 if __name__ == "__main__":
-    fig, df = monte_carlo("AAPL", frame="month", col="Close")
-    # open the figure and keep open
-    plt.show(block=True)
+    png, df = monte_carlo("AAPL", frame="month", col="Close")
+    with open("monte_carlo.png", "wb") as f:
+        f.write(png)
+    print(df)
@@ -1,10 +1,8 @@
-from ftplib import FTP
+import numpy as np
 import pandas as pd
-import urllib3
 import discord
 import sys
 import json
-http = urllib3.PoolManager()
 
 # config is at the root of the project
 # since this file is normally imported from the root of the project
@@ -12,69 +10,107 @@ http = urllib3.PoolManager()
 if __name__ == "__main__":
     sys.path.append("..")
 import config as CONFIG
+import discord_actions.metrics as metrics
+import discord_actions.providers as providers
+import discord_actions.symbols as symbols
 
 import sys
+import os
 import asyncio
 
 """
 Track live momement of tickers and send alerts when they move
 past a certain threshold.
 """
-tickers = False
-
 async def retrieve_tickers():
-    # prevent calling of ftp server after the first time running the function
-    global tickers
-    if tickers: return tickers
-
-    """
-    Retrieve tickers from FTP server.
-    ftp://ftp.nasdaqtrader.com/symboldirectory/
-    """
-    ftp = FTP("ftp.nasdaqtrader.com")
-    ftp.login()
-    ftp.cwd("symboldirectory")
-    with open("nasdaqtraded.txt", "wb") as f:
-        ftp.retrbinary("RETR nasdaqtraded.txt", f.write)
-    ftp.quit()
-
-    tickers = pd.read_csv("nasdaqtraded.txt", sep="|")["Symbol"][:-1]
-    blacklist = ['.', '$']
-    tickers = [str(ticker) for ticker in tickers if all(char not in str(ticker) for char in blacklist)]
-    return tickers
+    # the directory is re-checked at most once a day, ftplib blocks so run it off the event loop;
+    # a local provider runs without a network, the bundled directory has to do
+    if CONFIG.PROVIDER != "local":
+        await asyncio.to_thread(symbols.refresh)
+    return symbols.movers_universe()
 
 async def get_tickers_json(bot):
     tickers = await retrieve_tickers()
-    # batch the tickers into groups of 1000
-    ticker_batches = [tickers[i : i + 1900] for i in range(0, len(tickers), 1900)]
-    # send the batches to the API
-    for batch in ticker_batches:
-        url = f"https://query1.finance.yahoo.com/v7/finance/quote?formatted=true&symbols={'%2c'.join(batch)}&corsDomain=finance.yahoo.com"
-        
-        response = http.request('GET', url)
-        data = json.loads(response.data)
-        for ticker in data["quoteResponse"]["result"]: await notify_if_appropriate(ticker["symbol"], ticker["regularMarketChangePercent"]["raw"], bot)
+    # the provider batches the symbols into as few requests as it can
+    quotes = to_frame(await providers.current().quotes(tickers))
+    alerts = find_alerts(quotes)
+    await send_alerts(alerts, bot)
+
+def to_frame(quotes):
+    # one row per quote, the scan below works on whole columns
+    quotes = [quote for quote in quotes if "regularMarketChangePercent" in quote]
+    return pd.DataFrame({
+        "symbol": [quote["symbol"] for quote in quotes],
+        "change": np.array([quote["regularMarketChangePercent"]["raw"] for quote in quotes], dtype=float),
+    })
+
+def load_state():
+    today = str(pd.Timestamp.now(tz="America/New_York").date())
+    try:
+        with open(CONFIG.MOVERS_STATE) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    # alerts start over every trading day
+    if state.get("date") != today:
+        state = {"date": today, "alerts": {}}
+    return state
+
+def save_state(state):
+    os.makedirs(os.path.dirname(CONFIG.MOVERS_STATE) or ".", exist_ok=True)
+    tmp = f"{CONFIG.MOVERS_STATE}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp, CONFIG.MOVERS_STATE)
+
+def find_alerts(quotes):
+    state = load_state()
+    # the move each symbol was last alerted at today, NaN if it wasn't
+    last = quotes["symbol"].map(state["alerts"]).astype(float)
+    above = quotes["change"] > CONFIG.THRESHOLD
+    # alert on crossing the threshold, or on moving REALERT_STEP further since the last alert
+    fire = above & (last.isna() | (quotes["change"] >= last + CONFIG.REALERT_STEP))
+
+    # symbols that fell back under the threshold alert again on their next crossing
+    below = set(quotes.loc[~above, "symbol"])
+    alerts = {symbol: change for symbol, change in state["alerts"].items() if symbol not in below}
+    fired = quotes[fire]
+    alerts.update(zip(fired["symbol"], fired["change"].round(2)))
+    state["alerts"] = alerts
+    save_state(state)
+    return fired.sort_values("change", ascending=False)
 
-async def notify_if_appropriate(ticker, percent_change, bot):
-    CHANNEL_ID = CONFIG.CHANNEL_ID
-    THRESHOLD = CONFIG.THRESHOLD
-    if percent_change > THRESHOLD:
-        # send alert to discord in the channel with the id CHANNEL_ID
-        channel = bot.get_channel(CHANNEL_ID)
-        message = f"{ticker} is on the move! It has moved {percent_change}% today. Buy it while it's hot!"
-        await channel.send(message)
+async def send_alerts(alerts, bot):
+    if alerts.empty: return
+    # send alert to discord in the channel with the id CHANNEL_ID
+    channel = bot.get_channel(CONFIG.CHANNEL_ID)
+    lines = [f"{symbol} has moved {round(change, 2)}% today." for symbol, change in zip(alerts["symbol"], alerts["change"])]
+    message = "These tickers are on the move! Buy them while they're hot!"
+    # one message for the whole sweep, split only at discord's 2000 character limit
+    for line in lines:
+        if len(message) + len(line) + 1 > 2000:
+            await channel.send(message)
+            message = ""
+        message = f"{message}\n{line}" if message else line
+    await channel.send(message)
 
 
 # start the movers thread
 async def start_movers(bot):
     print("Starting movers subprocess...")
     while True:
-        await get_tickers_json(bot)
+        # one failed sweep (quotes, state file, channel) mustn't stop the alerts for good
+        try:
+            with metrics.timer("movers_sweep_seconds"):
+                await get_tickers_json(bot)
+        except Exception as e:
+            print(f"Movers sweep failed: {e!r}")
         # sleep without blocking the main thread for 10 minutes
         await asyncio.sleep(600)
 
 if __name__ == "__main__":
-    t = retrieve_tickers()
-    # batch the tickers into groups of 1900 (browser URI limit is 2000)
-    ticker_batches = [t[i : i + 1900] for i in range(0, len(t), 1900)]
+    t = symbols.movers_universe()
+    # batch the tickers into groups of BATCH_SIZE
+    BATCH_SIZE = providers.YFinanceProvider.BATCH_SIZE
+    ticker_batches = [t[i : i + BATCH_SIZE] for i in range(0, len(t), BATCH_SIZE)]
     print('%2c'.join(ticker_batches[0]))
\ No newline at end of file
@@ -1,34 +1,120 @@
+import asyncio
+import hashlib
 import sys
+import threading
+import time
+
 import pandas as pd
-from bs4 import BeautifulSoup
-import cloudscraper
-import nltk
 
 sys.path.append("..")
+import config as CONFIG
 
-import yfinance as yf
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
+import discord_actions.providers as providers
+from discord_actions.cache import TTLCache
+
+# headlines don't change once published, scores only leave the cache to make room
+SCORE_TTL = 7 * 24 * 60 * 60
+
+_analyzer = None
+_analyzer_lock = threading.Lock()
+# compound score of every headline seen, by article uuid or title hash
+scores = TTLCache(CONFIG.SENTIMENT_CACHE_SIZE, name="sentiment")
+# ticker -> (sentiment, articles, updated) for the watchlist, kept fresh by start_sentiment
+table = {}
 
-scraper = cloudscraper.create_scraper(
-    browser={"browser": "chrome", "platform": "windows", "desktop": True}
-)
+
+def analyzer():
+    # loading the VADER lexicon is the slow part, do it once per process
+    global _analyzer
+    with _analyzer_lock:
+        if _analyzer is None:
+            _analyzer = SentimentIntensityAnalyzer()
+        return _analyzer
 
 
 def news(ticker):
     # get news on ticker
-    _ticker = yf.Ticker(ticker)
-    news = _ticker.news
+    news = providers.current().get(ticker, "news")
     return news
 
 
+def _key(article):
+    uuid = article.get("uuid") or article.get("id")
+    if uuid:
+        return uuid
+    return hashlib.sha1(article["title"].encode()).hexdigest()
+
+
+def score(articles):
+    # compound score per article, only headlines not seen before are scored
+    keys = [_key(article) for article in articles]
+    known = {key: scores.get(key, name="sentiment") for key in set(keys)}
+    for key, article in zip(keys, articles):
+        if known[key] is None:
+            known[key] = analyzer().polarity_scores(article["title"])["compound"]
+            scores.put(key, known[key], SCORE_TTL)
+    return [known[key] for key in keys]
+
+
+def _mean(values):
+    return round(sum(values) / len(values), 2) if values else None
+
+
 def sentimentv2(ticker):
-    _news = news(ticker)
-    # Sentiment Analysis
-    analyzer = SentimentIntensityAnalyzer()
-    sentiments = [analyzer.polarity_scores(article["title"]) for article in _news]
-    # get mean of sentiments
-    sentiments_mean = pd.DataFrame(sentiments).mean()
-    return round(sentiments_mean["compound"], 2)
+    # mean compound score of the ticker's headlines, None without news
+    return _mean(score(news(ticker)))
+
+
+def batch(tickers):
+    # sentiment of many tickers: news is fetched in one bulk call, then every
+    # distinct headline is scored once even when several tickers share it
+    found = providers.current().fields(tickers, "news")
+    # a ticker whose news failed scores like one without news
+    fetched = [found.get(ticker, []) for ticker in tickers]
+    flat = [article for articles in fetched for article in articles]
+    flat_scores = score(flat)
+    results, i = {}, 0
+    for ticker, articles in zip(tickers, fetched):
+        results[ticker] = (_mean(flat_scores[i : i + len(articles)]), len(articles))
+        i += len(articles)
+    return results
+
+
+def refresh_table(tickers):
+    updated = time.time()
+    for ticker, (sentiment, articles) in batch(tickers).items():
+        table[ticker] = (sentiment, articles, updated)
+
+
+def lookup(ticker):
+    # the table's score while it is fresh, otherwise score the ticker now
+    entry = table.get(ticker)
+    if entry is not None and time.time() - entry[2] < 2 * CONFIG.SENTIMENT_REFRESH:
+        return entry[0]
+    return sentimentv2(ticker)
+
+
+def frame():
+    # the sentiment table as a DataFrame, most positive first
+    df = pd.DataFrame.from_dict(
+        table, orient="index", columns=["sentiment", "articles", "updated"]
+    )
+    df["updated"] = pd.to_datetime(df["updated"], unit="s")
+    return df.sort_values("sentiment", ascending=False)
+
+
+async def start_sentiment(tickers):
+    # tickers is called before every sweep so watchlist edits are picked up
+    print("Starting sentiment refresh...")
+    while True:
+        started = time.time()
+        try:
+            await asyncio.to_thread(refresh_table, tickers())
+        except Exception as e:
+            print(f"Sentiment refresh failed: {e!r}")
+        await asyncio.sleep(max(CONFIG.SENTIMENT_REFRESH - (time.time() - started), 0))
+
 
 if __name__ == "__main__":
     print(sentimentv2("AAPL"))
@@ -1,50 +1,69 @@
-from statsforecast import StatsForecast
-from statsforecast.models import AutoARIMA, AutoETS, AutoCES, AutoTheta
-import matplotlib.pyplot as plt
-import pandas as pd
+import os
 import sys
 
 sys.path.append("..")
-import discord_actions.actions as ac
+import config as CONFIG
 
-sf = StatsForecast(
-    models=[AutoARIMA(season_length=7)],
-    freq="D",
-)
-sf2 = StatsForecast(
-    models=[AutoETS(season_length=7)],
-    freq="D",
-)
-sf3 = StatsForecast(
-    models=[AutoCES(season_length=7)],
-    freq="D",
-)
-sf4 = StatsForecast(
-    models=[AutoTheta(season_length=7)],
-    freq="D",
+# keep numba's compiled statsforecast kernels on disk between restarts,
+# these have to be set before statsforecast is imported
+os.environ.setdefault("NIXTLA_NUMBA_CACHE", "1")
+os.environ.setdefault("NUMBA_CACHE_DIR", CONFIG.NUMBA_CACHE_DIR)
+
+from statsforecast import StatsForecast
+from statsforecast.models import AutoARIMA, AutoETS, AutoCES, AutoTheta
+import numpy as np
+import pandas as pd
+import discord_actions.actions as ac
+import discord_actions.render as render
+from discord_actions.cache import TTLCache
+
+frame_nums = {"day": 1, "week": 7, "month": 30, "year": 365}
+MODELS = {"arima": AutoARIMA, "ets": AutoETS, "ces": AutoCES, "theta": AutoTheta}
+TITLES = {"arima": "ARIMA", "ets": "ETS", "ces": "CES", "theta": "Theta"}
+
+# finished forecasts, keyed on the last bar they were fitted on
+forecasts = TTLCache(
+    CONFIG.FORECAST_CACHE_SIZE,
+    CONFIG.FORECAST_CACHE_DIR,
+    name="forecasts",
+    disk_maxsize=CONFIG.FORECAST_CACHE_DISK_SIZE,
 )
+FORECAST_TTL = 7 * 24 * 60 * 60
 
 
-def arima(ticker, frame="week", col="Close"):
-    frame_nums = {"day": 1, "week": 7, "month": 30, "year": 365}
+def _backdata(frame):
+    # the models require a lot of historical data to make a good forecast
+    num_days = frame_nums.get(frame)
+    return 14 if num_days <= 14 else num_days * 2
+
+
+def fetch(ticker, frame="week", col="Close", df=None):
+    # the I/O half of a forecast, the scheduler runs it on the thread pool and
+    # passes the result on as df; only the fitting window (which also covers
+    # the plotted past) is fetched
+    return {"df": ac.history_to_sf(ticker, col, bars=_backdata(frame))}
+
+
+def _forecast(ticker, model, frame, col, df=None):
     # get the number of days in the frame
     num_days = frame_nums.get(frame)
-    df = ac.history_to_sf(ticker, col)
-    df = df[~(df == 0).any(axis=1)]
+    if df is None:
+        df = fetch(ticker, frame, col)["df"]
+
+    # the input only changes when a new bar arrives (or today's bar moves),
+    # so the last bar identifies the fit
+    key = (ticker, model, frame, col, df["ds"].iloc[-1], float(df["y"].iloc[-1]))
+    result = forecasts.get(key, name=f"forecast_{model}")
+    if result is not None:
+        return result
+
     pasttime_x = df["ds"].tail(num_days * 2)
     pasttime_y = df["y"].tail(num_days * 2)
 
-    # initialize the plot
-    fig = plt.figure()
-    plt.plot(pasttime_x, pasttime_y)
-    plt.title(f"ARIMA: {ticker}")
-    plt.xlabel("Time (Days)")
-    plt.ylabel(f"{col} Price($)")
-    plt.grid()
-
-    # arima requires a lot of historical data to make a good forecast
-    backdata = 14 if num_days <= 14 else num_days*2
-    sf.fit(df.tail(backdata))
+    # a fresh StatsForecast per call, concurrent commands must not share one
+    sf = StatsForecast(models=[MODELS[model](season_length=7)], freq="D")
+    alias = sf.models[0].alias
+    sf.fit(df)
     forecast_df = sf.predict(h=num_days, level=[90])
     # add a day to the beginning of the forecast with a date of 1 + the last date in the past
     # and a y value of the first y value in the forecast
@@ -53,138 +72,165 @@ def arima(ticker, frame="week", col="Close"):
             pd.DataFrame(
                 {
                     "ds": [forecast_df["ds"].iloc[0] - pd.Timedelta(1, unit="D")],
-                    "AutoARIMA": [pasttime_y.iloc[-1]],
+                    alias: [pasttime_y.iloc[-1]],
                 }
             ),
             forecast_df,
         ],
         ignore_index=True,
     )
+    forecast_df.drop(
+        columns=["unique_id", f"{alias}-lo-90", f"{alias}-hi-90"],
+        errors="ignore",
+        inplace=True,
+    )
 
-    forecast_df.drop(columns=["AutoARIMA-lo-90", "AutoARIMA-hi-90"], inplace=True)
-    # add the forecast to the plot
-    plt.plot(forecast_df["ds"], forecast_df["AutoARIMA"])
+    # plot the past window with the forecast after it
+    png = render.draw(
+        render.line_chart,
+        [(pasttime_x, pasttime_y), (forecast_df["ds"], forecast_df[alias])],
+        f"{TITLES[model]}: {ticker}",
+        "Time (Days)",
+        f"{col} Price($)",
+    )
 
-    return [fig, forecast_df.set_index("ds")]
+    result = [png, forecast_df.set_index("ds")]
+    forecasts.put(key, result, FORECAST_TTL)
+    return result
 
 
-def ets(ticker, frame="week", col="Close"):
-    frame_nums = {"day": 1, "week": 7, "month": 30, "year": 365}
-    # get the number of days in the frame
-    num_days = frame_nums.get(frame)
-    df = ac.history_to_sf(ticker, col)
-    df = df[~(df == 0).any(axis=1)]
-    pasttime_x = df["ds"].tail(num_days * 2)
-    pasttime_y = df["y"].tail(num_days * 2)
+def arima(ticker, frame="week", col="Close", df=None):
+    return _forecast(ticker, "arima", frame, col, df)
 
-    # initialize the plot
-    fig = plt.figure()
-    plt.plot(pasttime_x, pasttime_y)
-    plt.title(f"ETS: {ticker}")
-    plt.xlabel("Time (Days)")
-    plt.ylabel(f"{col} Price($)")
-    plt.grid()
-
-    # ets requires a lot of historical data to make a good forecast
-    backdata = 14 if num_days <= 14 else num_days*2
-    sf2.fit(df.tail(backdata))
-    forecast_df = sf2.predict(h=num_days, level=[90])
-    forecast_df = pd.concat(
-        [
-            pd.DataFrame(
-                {
-                    "ds": [forecast_df["ds"].iloc[0] - pd.Timedelta(1, unit="D")],
-                    "AutoETS": [pasttime_y.iloc[-1]],
-                }
-            ),
-            forecast_df,
-        ],
-        ignore_index=True,
-    )
-    forecast_df.drop(columns=["AutoETS-lo-90", "AutoETS-hi-90"], inplace=True)
 
-    # add the forecast to the plot
-    plt.plot(forecast_df["ds"], forecast_df["AutoETS"])
+def ets(ticker, frame="week", col="Close", df=None):
+    return _forecast(ticker, "ets", frame, col, df)
 
-    return [fig, forecast_df.set_index("ds")]
 
+def ces(ticker, frame="week", col="Close", df=None):
+    return _forecast(ticker, "ces", frame, col, df)
 
-def ces(ticker, frame="week", col="Close"):
-    frame_nums = {"day": 1, "week": 7, "month": 30, "year": 365}
-    # get the number of days in the frame
+
+def theta(ticker, frame="week", col="Close", df=None):
+    return _forecast(ticker, "theta", frame, col, df)
+
+
+def ensemble(ticker, frame="week", col="Close", df=None):
     num_days = frame_nums.get(frame)
-    df = ac.history_to_sf(ticker, col)
-    df = df[~(df == 0).any(axis=1)]
+    if df is None:
+        df = fetch(ticker, frame, col)["df"]
+
+    key = (ticker, "ensemble", frame, col, df["ds"].iloc[-1], float(df["y"].iloc[-1]))
+    result = forecasts.get(key, name="forecast_ensemble")
+    if result is not None:
+        return result
+
     pasttime_x = df["ds"].tail(num_days * 2)
     pasttime_y = df["y"].tail(num_days * 2)
 
-    # initialize the plot
-    fig = plt.figure()
-    plt.plot(pasttime_x, pasttime_y)
-    plt.title(f"CES: {ticker}")
-    plt.xlabel("Time (Days)")
-    plt.ylabel(f"{col} Price($)")
-    plt.grid()
-
-    # ces requires a lot of historical data to make a good forecast
-    backdata = 14 if num_days <= 14 else num_days*2
-    sf3.fit(df.tail(backdata))
-    forecast_df = sf3.predict(h=num_days, level=[90])
-    forecast_df = pd.concat(
-        [
-            pd.DataFrame(
-                {
-                    "ds": [forecast_df["ds"].iloc[0] - pd.Timedelta(1, unit="D")],
-                    "CES": [pasttime_y.iloc[-1]],
-                }
-            ),
-            forecast_df,
+    # every model fitted in one pass over the same prepared series; statsforecast
+    # parallelizes over series, so a single ticker runs on one CPU worker
+    sf = StatsForecast(
+        models=[model(season_length=7) for model in MODELS.values()], freq="D"
+    )
+    aliases = [model.alias for model in sf.models]
+    forecast_df = sf.forecast(df=df, h=num_days, level=[90])
+    forecast_df = forecast_df.reset_index(drop=True).drop(
+        columns=["unique_id"], errors="ignore"
+    )
+    forecast_df["Ensemble"] = forecast_df[aliases].mean(axis=1)
+
+    # start every line at the last observed value, like the single model forecasts
+    names = aliases + ["Ensemble"]
+    first = pd.DataFrame(
+        {
+            "ds": [forecast_df["ds"].iloc[0] - pd.Timedelta(1, unit="D")],
+            **{name: [pasttime_y.iloc[-1]] for name in names},
+        }
+    )
+    forecast_df = pd.concat([first, forecast_df], ignore_index=True)
+
+    ahead = forecast_df.iloc[1:]
+    png = render.draw(
+        render.line_chart,
+        [(pasttime_x, pasttime_y)]
+        + [(forecast_df["ds"], forecast_df[name]) for name in names],
+        f"Ensemble: {ticker}",
+        "Time (Days)",
+        f"{col} Price($)",
+        labels=[col] + names,
+        # line 0 is the past, the models follow in order
+        bands=[
+            (i + 1, ahead["ds"], ahead[f"{alias}-lo-90"], ahead[f"{alias}-hi-90"])
+            for i, alias in enumerate(aliases)
         ],
-        ignore_index=True,
     )
 
-    # add the forecast to the plot
-    plt.plot(forecast_df["ds"], forecast_df["CES"])
+    result = [png, forecast_df.set_index("ds")]
+    forecasts.put(key, result, FORECAST_TTL)
+    return result
 
-    return [fig, forecast_df.set_index("ds")]
 
+# fetched on the I/O lane before the fit goes to the CPU lane
+for _command in (arima, ets, ces, theta, ensemble):
+    _command.prepare = fetch
 
-def theta(ticker, frame="week", col="Close"):
-    frame_nums = {"day": 1, "week": 7, "month": 30, "year": 365}
-    # get the number of days in the frame
-    num_days = frame_nums.get(frame)
-    df = ac.history_to_sf(ticker, col)
-    df = df[~(df == 0).any(axis=1)]
-    pasttime_x = df["ds"].tail(num_days * 2)
-    pasttime_y = df["y"].tail(num_days * 2)
 
-    # initialize the plot
-    fig = plt.figure()
-    plt.plot(pasttime_x, pasttime_y)
-    plt.title(f"Theta: {ticker}")
-    plt.xlabel("Time (Days)")
-    plt.ylabel(f"{col} Price($)")
-    plt.grid()
-
-    # arima requires a lot of historical data to make a good forecast
-    backdata = 14 if num_days <= 14 else num_days*2
-    sf4.fit(df.tail(backdata))
-    forecast_df = sf4.predict(h=num_days, level=[90])
-    forecast_df = pd.concat(
-        [
-            pd.DataFrame(
-                {
-                    "ds": [forecast_df["ds"].iloc[0] - pd.Timedelta(1, unit="D")],
-                    "AutoTheta": [pasttime_y.iloc[-1]],
-                }
-            ),
-            forecast_df,
-        ],
-        ignore_index=True,
+def warmup():
+    # fit every model once on a small synthetic series so the first command
+    # doesn't pay for compiling (or loading from the numba cache) the kernels
+    steps = np.arange(56)
+    df = pd.DataFrame(
+        {
+            "unique_id": "warmup",
+            "ds": pd.date_range("2000-01-01", periods=len(steps), freq="D"),
+            "y": 100 + np.sin(steps * 2 * np.pi / 7) + steps * 0.1,
+        }
     )
-    forecast_df.drop(columns=["AutoTheta-lo-90", "AutoTheta-hi-90"], inplace=True)
+    models = [model(season_length=7) for model in MODELS.values()]
+    StatsForecast(models=models, freq="D").forecast(df=df, h=7, level=[90])
 
-    # add the forecast to the plot
-    plt.plot(forecast_df["ds"], forecast_df["AutoTheta"])
 
-    return [fig, forecast_df.set_index("ds")]
+def forecast_many(tickers, model="arima", frame="week", col="Close", n_jobs=-1):
+    num_days = frame_nums.get(frame)
+    backdata = _backdata(frame)
+
+    # stack every ticker into one long-format panel, one unique_id per ticker
+    # a ticker that fails (rate limit, delisted) is skipped, not the whole run
+    frames = []
+    for ticker in tickers:
+        if not ticker:
+            continue
+        try:
+            df = ac.history_to_sf(ticker, col, bars=backdata)
+        except Exception as e:
+            print(f"History for {ticker} failed: {e!r}")
+            continue
+        if df.empty:
+            continue
+        frames.append(df.assign(unique_id=ticker))
+    if not frames:
+        return pd.DataFrame(columns=["unique_id", "ds"])
+    panel = pd.concat(frames, ignore_index=True)
+
+    # all series are fitted by a single StatsForecast spread over n_jobs processes
+    batch = StatsForecast(
+        models=[MODELS[model](season_length=7)],
+        freq="D",
+        n_jobs=n_jobs,
+    )
+    forecast_df = batch.forecast(df=panel, h=num_days, level=[90])
+    if "unique_id" not in forecast_df.columns:
+        forecast_df = forecast_df.reset_index()
+    return forecast_df
+
+
+if __name__ == "__main__":
+    # nightly run: python -m algorithms.singleline [model] [frame] [col]
+    args = sys.argv[1:] + ["arima", "week", "Close"][len(sys.argv[1:]) :]
+    model, frame, col = args[:3]
+    forecast_df = forecast_many(ac.file_as_list(), model, frame, col)
+    os.makedirs("data/forecasts", exist_ok=True)
+    path = f"data/forecasts/{pd.Timestamp.today().date()}_{model}_{frame}_{col}.csv"
+    forecast_df.to_csv(path, index=False)
+    print(f"Saved {forecast_df['unique_id'].nunique()} forecasts to {path}")
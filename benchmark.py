@@ -0,0 +1,345 @@
+"""
+Offline benchmark of every bot command against recorded market data.
+
+    python benchmark.py record AAPL MSFT   # capture yfinance and quote fixtures (online)
+    python benchmark.py run --repeat 5     # replay them through every command (offline)
+    python benchmark.py compare data/benchmarks/old.json data/benchmarks/new.json
+
+`run` calls each command's callback with a fake ctx and splits its time into
+stages: fetch (replayed yfinance/quote calls), transform (actions.py history
+and frame building), compute (montecarlo/singleline), render (charts), format
+(to_markdown) and send. The first run of each command is cold (empty caches
+and history store) and the rest are warm, or all of them with --cold. Results
+are saved as JSON, and `compare` exits non-zero when a command got slower
+than the baseline.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import Future
+from contextlib import ExitStack, contextmanager
+from unittest import mock
+
+import pandas as pd
+
+import config as CONFIG
+import discord_actions.providers as providers
+
+STAGES = ["fetch", "transform", "compute", "render", "format", "send"]
+# ticker used for the commands that take one
+DEFAULT_TICKER = "AAPL"
+# a median this much slower than the baseline counts as a regression
+REGRESSION = 1.2
+
+# seconds per stage of the command being run, and the time spent in nested stages
+_timings = None
+_nested = []
+
+
+@contextmanager
+def stage(name):
+    # time spent in a stage nested inside another only counts for the inner one
+    started = time.perf_counter()
+    _nested.append(0.0)
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        inner = _nested.pop()
+        if _timings is not None:
+            _timings[name] += elapsed - inner
+        if _nested:
+            _nested[-1] += elapsed
+
+
+def timed(name, fn):
+    def wrapper(*args, **kwargs):
+        with stage(name):
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+class ReplayProvider(providers.LocalProvider):
+    # replays the recordings, every call counted as the fetch stage
+    def get(self, ticker, field):
+        with stage("fetch"):
+            return super().get(ticker, field)
+
+    def fields(self, tickers, field):
+        # one after the other, stages are timed on this thread only
+        with stage("fetch"):
+            return {
+                ticker: self.get(ticker, field)
+                for ticker in tickers
+                if self.has(ticker)
+            }
+
+    def history(self, ticker, start=None):
+        with stage("fetch"):
+            return super().history(ticker, start)
+
+    def history_bulk(self, tickers, start=None, end=None):
+        with stage("fetch"):
+            return super().history_bulk(tickers, start, end)
+
+    async def quotes(self, tickers):
+        with stage("fetch"):
+            return await super().quotes(tickers)
+
+
+class FakeUser:
+    id = 0
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, *args, **kwargs):
+        with stage("send"):
+            self.sent.append((args, kwargs))
+
+
+class FakeContext:
+    # just what the command callbacks touch
+    def __init__(self):
+        self.author = FakeUser()
+        self.message = mock.Mock(author=self.author)
+        self.channel = FakeUser()
+
+    async def send(self, *args, **kwargs):
+        await self.channel.send(*args, **kwargs)
+
+
+def _inline_submit(renderer, *args, **kwargs):
+    future = Future()
+    future.set_result(renderer(*args, **kwargs))
+    return future
+
+
+async def _unblock(fn, *args, **kwargs):
+    # run in this thread so every stage is measured, simulations and fits are compute
+    name = "compute" if fn.__module__.startswith("algorithms") else "transform"
+    with stage(name):
+        return fn(*args, **kwargs)
+
+
+def patches(stack):
+    import bot
+    import algorithms.movers as mv
+    import discord_actions.actions as ac
+    import discord_actions.render as render
+
+    render.INLINE = True
+    providers.use(providers.CachingProvider(ReplayProvider(CONFIG.BENCH_FIXTURES)))
+    for target, attribute, value in [
+        (mv, "to_frame", timed("compute", mv.to_frame)),
+        (mv, "find_alerts", timed("compute", mv.find_alerts)),
+        (bot, "unblock_function", _unblock),
+        (render, "submit", timed("render", _inline_submit)),
+        (render, "draw", timed("render", render.draw)),
+        (ac, "get_history", timed("transform", ac.get_history)),
+        (ac, "get_history_bulk", timed("transform", ac.get_history_bulk)),
+        (ac, "history_to_sf", timed("transform", ac.history_to_sf)),
+        (pd.DataFrame, "to_markdown", timed("format", pd.DataFrame.to_markdown)),
+        (pd.Series, "to_markdown", timed("format", pd.Series.to_markdown)),
+    ]:
+        stack.enter_context(mock.patch.object(target, attribute, value))
+
+
+def cases(ticker):
+    # (name, coroutine factory taking a fake ctx) for every prefix command and the movers sweep
+    import bot
+    import algorithms.movers as mv
+
+    for command in sorted(bot.bot.commands, key=lambda command: command.name):
+        if command.name == "help":
+            continue
+        args = (ticker,) if "ticker" in command.clean_params else ()
+        yield command.name, lambda ctx, command=command, args=args: command.callback(
+            ctx, *args
+        )
+
+    def movers(ctx):
+        return mv.get_tickers_json(mock.Mock(get_channel=lambda _: ctx.channel))
+
+    yield "movers", movers
+
+
+def reset_caches():
+    # forget everything cached in memory and on disk, for a cold run
+    import algorithms.sentiment as sn
+    import algorithms.singleline as sl
+    from discord_actions.cache import metadata
+
+    for cache in (metadata, sl.forecasts, sn.scores):
+        with cache.lock:
+            cache.entries.clear()
+        if cache.directory:
+            shutil.rmtree(cache.directory, ignore_errors=True)
+    shutil.rmtree(CONFIG.HISTORY_DIR, ignore_errors=True)
+    shutil.rmtree(os.path.dirname(CONFIG.MOVERS_STATE), ignore_errors=True)
+    os.makedirs(os.path.dirname(CONFIG.MOVERS_STATE))
+
+
+async def run_case(name, make, run, state):
+    global _timings
+    _timings = dict.fromkeys(STAGES, 0.0)
+    ctx = FakeContext()
+    error = None
+    started = time.perf_counter()
+    try:
+        await make(ctx)
+    except Exception as e:
+        error = repr(e)
+    total = time.perf_counter() - started
+    result = dict(command=name, run=run, state=state, total=total, **_timings)
+    result["other"] = total - sum(_timings.values())
+    result["error"] = error
+    _timings = None
+    return result
+
+
+async def run_all(ticker, repeat, only, cold):
+    results = []
+    with ExitStack() as stack:
+        patches(stack)
+        for name, make in cases(ticker):
+            if only and name not in only:
+                continue
+            for run in range(repeat):
+                state = "cold" if cold or run == 0 else "warm"
+                if state == "cold":
+                    reset_caches()
+                results.append(await run_case(name, make, run, state))
+            print(f"{name}: {results[-1]['total']:.3f}s {results[-1]['error'] or ''}")
+    return results
+
+
+def summarize(results):
+    # median seconds per stage of each command, cold and warm runs apart
+    df = pd.DataFrame(results)
+    return df.groupby(["state", "command"])[["total", *STAGES, "other"]].median()
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        return None
+
+
+def run(args):
+    if not providers.LocalProvider(CONFIG.BENCH_FIXTURES).has(args.ticker):
+        sys.exit(
+            f"No fixture for {args.ticker} in {CONFIG.BENCH_FIXTURES}, record one first"
+        )
+    # a scratch history store and caches, the real ones stay untouched
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as scratch:
+        for setting in ["HISTORY_DIR", "CACHE_DIR", "FORECAST_CACHE_DIR"]:
+            setattr(CONFIG, setting, os.path.join(scratch, setting.lower()))
+        CONFIG.MOVERS_STATE = os.path.join(scratch, "movers", "state.json")
+        CONFIG.WORKER_MODE = False
+        CONFIG.PROVIDER = "local"
+        # created on import, before the settings above
+        providers.metadata.directory = CONFIG.CACHE_DIR
+        results = asyncio.run(run_all(args.ticker, args.repeat, args.only, args.cold))
+    print(summarize(results).round(4).to_markdown())
+
+    os.makedirs(CONFIG.BENCH_RESULTS, exist_ok=True)
+    output = args.output or os.path.join(
+        CONFIG.BENCH_RESULTS, f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "revision": _git_revision(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "ticker": args.ticker,
+                "repeat": args.repeat,
+                "results": results,
+            },
+            f,
+            indent=1,
+        )
+    print(f"Saved to {output}")
+
+
+def compare(args):
+    summaries = []
+    for path in (args.baseline, args.current):
+        with open(path) as f:
+            summaries.append(summarize(json.load(f)["results"])["total"])
+    df = pd.concat(summaries, axis=1, keys=["baseline", "current"]).dropna()
+    df.index = [f"{command} ({state})" for state, command in df.index]
+    df["ratio"] = df["current"] / df["baseline"]
+    print(df.sort_values("ratio", ascending=False).round(4).to_markdown())
+    slower = df[df["ratio"] > args.threshold]
+    if not slower.empty:
+        sys.exit(f"Slower than the baseline: {', '.join(slower.index)}")
+
+
+async def _record_quotes(source):
+    import discord_actions.symbols as symbols
+
+    symbols.refresh()
+    try:
+        return await source.quotes(symbols.movers_universe())
+    finally:
+        if source.session is not None:
+            await source.session.close()
+
+
+def record(args):
+    source = providers.YFinanceProvider()
+    local = providers.LocalProvider(CONFIG.BENCH_FIXTURES)
+    # ?top reads the first tickers of the watchlist, record those too
+    with open(CONFIG.WATCHLIST) as f:
+        watchlist = f.read().split()[: args.top]
+    for ticker in dict.fromkeys([*args.tickers, *watchlist]):
+        local.record(source, [ticker])
+        print(f"Recorded {ticker}")
+
+    quotes = asyncio.run(_record_quotes(source))
+    local.record_quotes(quotes)
+    print(f"Recorded {len(quotes)} quotes")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    commands = parser.add_subparsers(dest="action", required=True)
+
+    parser_record = commands.add_parser("record", help="capture fixtures from Yahoo")
+    parser_record.add_argument("tickers", nargs="*", default=[DEFAULT_TICKER])
+    parser_record.add_argument("--top", type=int, default=10)
+
+    parser_run = commands.add_parser("run", help="replay every command offline")
+    parser_run.add_argument("--ticker", default=DEFAULT_TICKER)
+    parser_run.add_argument("--repeat", type=int, default=5)
+    parser_run.add_argument("--only", nargs="*", help="command names to run")
+    parser_run.add_argument(
+        "--cold", action="store_true", help="empty every cache before each run"
+    )
+    parser_run.add_argument("--output")
+
+    parser_compare = commands.add_parser("compare", help="diff two saved runs")
+    parser_compare.add_argument("baseline")
+    parser_compare.add_argument("current")
+    parser_compare.add_argument("--threshold", type=float, default=REGRESSION)
+
+    args = parser.parse_args(argv)
+    {"record": record, "run": run, "compare": compare}[args.action](args)
+
+
+if __name__ == "__main__":
+    main()
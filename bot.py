@@ -1,21 +1,49 @@
 import discord
 from io import BytesIO
 from discord.ext import commands
+from discord import app_commands
 from dotenv import load_dotenv
 import os
 from datetime import datetime
-import discord_actions.actions as ac
-import algorithms.montecarlo as mc
-import algorithms.singleline as sl
-from algorithms.movers import *
 import pandas as pd
-import functools
 import asyncio
-import matplotlib
-
-matplotlib.use("agg")
-import matplotlib.pyplot as plt
-from PIL import Image
+import importlib
+import threading
+import contextvars
+import time
+import config as CONFIG
+
+
+class LazyModule:
+    # imports the module on first attribute access, from whichever thread gets there first
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.resolve(), attr)
+
+
+# statsforecast, matplotlib, scipy, nltk and yfinance are only imported when needed
+ac = LazyModule("discord_actions.actions")
+mc = LazyModule("algorithms.montecarlo")
+sl = LazyModule("algorithms.singleline")
+mv = LazyModule("algorithms.movers")
+sn = LazyModule("algorithms.sentiment")
+render = LazyModule("discord_actions.render")
+scheduler = LazyModule("discord_actions.scheduler")
+jobs = LazyModule("discord_actions.jobs")
+symbols = LazyModule("discord_actions.symbols")
+metrics = LazyModule("discord_actions.metrics")
+profiler = LazyModule("discord_actions.profiler")
 
 # invite url: https://discord.com/oauth2/authorize?client_id=1062847336503586866&permissions=116736&scope=bot
 load_dotenv()
@@ -26,34 +54,214 @@ intents.message_content = True
 bot = commands.Bot(command_prefix="?", intents=intents)
 
 
+# executor calls currently running, keyed on the function and its arguments
+in_flight = {}
+# id of the user the running command replies to, recorded on queued jobs
+reply_target = contextvars.ContextVar("reply_target", default=None)
+# [seconds] the running command spent awaiting executors and the render pool
+waited = contextvars.ContextVar("waited", default=None)
+# [seconds] the running command spent sending messages to discord
+sent = contextvars.ContextVar("sent", default=None)
+
+
+def record_wait(histogram, started, **labels):
+    elapsed = time.perf_counter() - started
+    metrics.observe(histogram, elapsed, **labels)
+    total = waited.get()
+    if total is not None:
+        total[0] += elapsed
+
+
+async def send(target, *args, **kwargs):
+    # every reply goes through here so the time spent uploading it is measured
+    started = time.perf_counter()
+    try:
+        return await target.send(*args, **kwargs)
+    finally:
+        total = sent.get()
+        if total is not None:
+            total[0] += time.perf_counter() - started
+
+
 # run pandas as nonblocking
 async def unblock_function(fn, *args, **kwargs):
-    func = functools.partial(fn, *args, **kwargs)
-    return await asyncio.get_event_loop().run_in_executor(None, func)
+    started = time.perf_counter()
+    try:
+        return await run_shared(fn, *args, **kwargs)
+    finally:
+        record_wait("unblock_seconds", started, function=metrics.function_name(fn))
+
+
+async def run_shared(fn, *args, **kwargs):
+    key = (fn.__module__, fn.__qualname__, args, tuple(sorted(kwargs.items())))
+    try:
+        hash(key)
+    except TypeError:
+        # unhashable arguments can't be shared, run them on their own
+        key = None
+    if profiler.active.get() is not None:
+        # a profiled call runs on its own, joining another call would record nothing
+        key = None
+
+    # identical concurrent calls wait on the one already running
+    if key in in_flight:
+        return await asyncio.shield(in_flight[key])
+
+    if CONFIG.WORKER_MODE:
+        # queue the call for the worker processes and wait for their result
+        job = jobs.submit(fn, *args, reply_to=reply_target.get(), **kwargs)
+    else:
+        # I/O goes to the thread pool, fits and simulations to the process pool
+        job = scheduler.run(fn, *args, **kwargs)
+    future = asyncio.ensure_future(job)
+    if key is not None:
+        in_flight[key] = future
+        future.add_done_callback(lambda _: in_flight.pop(key, None))
+    # shielded so one cancelled waiter doesn't cancel the others
+    return await asyncio.shield(future)
+
+
+# render a chart in the render process pool without holding an executor thread
+async def render_chart(renderer, *args, **kwargs):
+    started = time.perf_counter()
+    try:
+        return await asyncio.wrap_future(render.submit(renderer, *args, **kwargs))
+    finally:
+        record_wait("render_seconds", started, renderer=renderer.__name__)
+
+
+def load_modules():
+    # import the heavy modules off the event loop
+    for module in (ac, mc, sl, mv, sn, render, scheduler, symbols):
+        module.resolve()
+    symbols.load()
+    # starts a render worker process
+    render.draw(render.line_chart, [([0, 1], [0, 1])], "warmup")
+
+
+async def warm_up():
+    if CONFIG.WORKER_MODE:
+        # the worker processes warm themselves up
+        return
+    # compile the forecast models in the CPU workers, not coalesced on purpose
+    await asyncio.gather(
+        *(scheduler.run(sl.warmup) for _ in range(scheduler.cpu.workers)),
+        return_exceptions=True,
+    )
+
+
+async def start_background():
+    # started once from setup(), so reconnects don't add more loops
+    await bot.wait_until_ready()
+    await asyncio.get_event_loop().run_in_executor(None, load_modules)
+    # make start_movers() task and pass argument of bot
+    bot.loop.create_task(mv.start_movers(bot))
+    bot.loop.create_task(sn.start_sentiment(ac.file_as_list))
+    await warm_up()
 
 
 @bot.event
 async def on_ready():
-    # make start_movers() task and pass argument of bot
-    bot.loop.create_task(start_movers(bot))
     print(f"{bot.user} has connected to Discord!")
 
 
+@bot.before_invoke
+async def before_command(ctx):
+    ctx.started = time.perf_counter()
+    waited.set([0.0])
+    sent.set([0.0])
+    reply_target.set(ctx.author.id)
+    # reject unknown tickers before any fetch or fit is started
+    arguments = dict(zip(ctx.command.clean_params, ctx.args[1:]))
+    ticker = arguments.get("ticker")
+    if ticker is not None and not symbols.is_known(ticker):
+        message = f"{ticker} is not a known ticker."
+        suggestions = symbols.suggest(ticker)
+        if suggestions:
+            options = ", ".join(f"{symbol} ({name})" for symbol, name in suggestions)
+            message += f" Did you mean {options}?"
+        raise commands.BadArgument(message)
+    # armed with ?profile, None otherwise; taken last so a rejected call doesn't use it up
+    profiler.active.set(profiler.take(ctx.command.name))
+
+
+@bot.after_invoke
+async def after_command(ctx):
+    # runs whether or not the command failed
+    total = time.perf_counter() - ctx.started
+    status = "error" if ctx.command_failed else "ok"
+    metrics.observe("command_seconds", total, command=ctx.command.name, status=status)
+    metrics.observe("send_seconds", sent.get()[0], command=ctx.command.name)
+    # what's left: formatting the replies and the hooks themselves
+    rest = total - waited.get()[0] - sent.get()[0]
+    metrics.observe("format_seconds", rest, command=ctx.command.name)
+
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(error, commands.CommandInvokeError) and isinstance(
+        error.original, scheduler.Busy
+    ):
+        await send(ctx, "The bot is busy right now, please try again in a minute.")
+        return
+    if isinstance(error, commands.CommandInvokeError) and isinstance(
+        error.original, jobs.JobTimeout
+    ):
+        await send(ctx, "No worker is free right now, please try again in a minute.")
+        return
+    if isinstance(error, commands.BadArgument):
+        await send(ctx, str(error))
+        return
+    # everything else keeps discord.py's default handling
+    await commands.Bot.on_command_error(bot, ctx, error)
+
+
+async def setup():
+    # runs once per process, on_ready runs again after every reconnect
+    await metrics.serve()
+    bot.loop.create_task(start_background())
+
+
+bot.setup_hook = setup
+
+
+@bot.tree.command(name="lookup", description="Find a ticker by symbol or company name")
+async def lookup(interaction: discord.Interaction, query: str):
+    matches = symbols.search(query, limit=10)
+    if not matches:
+        await interaction.response.send_message(
+            f"No tickers match {query}.", ephemeral=True
+        )
+        return
+    text = "\n".join(f"{symbol}: {name}" for symbol, name in matches)
+    await interaction.response.send_message(f"""```{text}```""", ephemeral=True)
+
+
+@lookup.autocomplete("query")
+async def lookup_autocomplete(interaction: discord.Interaction, current: str):
+    # choice labels are capped at 100 characters
+    return [
+        app_commands.Choice(name=f"{symbol}: {name}"[:100], value=symbol)
+        for symbol, name in symbols.search(current, limit=25)
+    ]
+
+
 @bot.command(name="info", help="Returns the info of a stock given ticker and timeframe")
 async def info(ctx, ticker="AAPL"):
-    await ctx.send("Compiling the data... Check your DMs...")
+    await send(ctx, "Compiling the data... Check your DMs...")
 
     df, sentiment = await unblock_function(ac.get_info, ticker)
+    # results can be shared with other callers, so filter into a new dict
     nonmetrics = ["phone", "website", "logo_url", "city", "state", "country"]
-    for nonmetric in nonmetrics:
-        del df[nonmetric]
+    df = {k: v for k, v in df.items() if k not in nonmetrics}
 
     text = pd.DataFrame.from_dict(df, orient="index").to_markdown()
 
     file = discord.File(
         BytesIO(str(f"""{text}""").encode()), filename=f"{ticker}_info.txt"
     )
-    await ctx.message.author.send(
+    await send(
+        ctx.message.author,
         file=file,
         content=f"[FSD {datetime.now()}] Here's your data: \n *Sentiment for {ticker} is: {sentiment}*",
     )
@@ -63,7 +271,7 @@ async def info(ctx, ticker="AAPL"):
     name="calendar", help="Returns the upcoming events of a stock given ticker"
 )
 async def calendar(ctx, ticker="AAPL"):
-    await ctx.send("Compiling the data... Check your DMs...")
+    await send(ctx, "Compiling the data... Check your DMs...")
 
     df = await unblock_function(ac.get_calendar, ticker)
     text = df.to_markdown()
@@ -71,7 +279,8 @@ async def calendar(ctx, ticker="AAPL"):
         BytesIO(str(f"""{text}""").encode()), filename=f"{ticker}_calendar.txt"
     )
 
-    await ctx.message.author.send(
+    await send(
+        ctx.message.author,
         file=file,
         content=f"[FSD {datetime.now()}] Here's your data: ",
     )
@@ -81,7 +290,7 @@ async def calendar(ctx, ticker="AAPL"):
     name="experts", help="Returns the expert recommendations of a stock given ticker"
 )
 async def experts(ctx, ticker="AAPL", timeframe="week"):
-    await ctx.send("Compiling the data... Check your DMs...")
+    await send(ctx, "Compiling the data... Check your DMs...")
 
     df = await unblock_function(ac.get_experts, ticker, timeframe)
     text = df.to_markdown()
@@ -89,7 +298,8 @@ async def experts(ctx, ticker="AAPL", timeframe="week"):
         BytesIO(str(f"""{text}""").encode()), filename=f"{ticker}_experts.txt"
     )
 
-    await ctx.message.author.send(
+    await send(
+        ctx.message.author,
         file=file,
         content=f"[FSD {datetime.now()}] Here's your data: ",
     )
@@ -99,7 +309,7 @@ async def experts(ctx, ticker="AAPL", timeframe="week"):
     name="sustainability", help="Returns the sustainability of a stock given ticker"
 )
 async def sustainability(ctx, ticker="AAPL"):
-    await ctx.send("Compiling the data... Check your DMs...")
+    await send(ctx, "Compiling the data... Check your DMs...")
 
     df = await unblock_function(ac.get_sustainability, ticker)
     text = df.to_markdown()
@@ -107,7 +317,8 @@ async def sustainability(ctx, ticker="AAPL"):
         BytesIO(str(f"""{text}""").encode()), filename=f"{ticker}_sustainability.txt"
     )
 
-    await ctx.message.author.send(
+    await send(
+        ctx.message.author,
         file=file,
         content=f"[FSD {datetime.now()}] Here's your data: ",
     )
@@ -115,36 +326,38 @@ async def sustainability(ctx, ticker="AAPL"):
 
 @bot.command(name="history", help="Returns the history of a stock given ticker")
 async def history(ctx, ticker="AAPL", period="max"):
-    await ctx.send("Compiling the data... Check your DMs...")
+    await send(ctx, "Compiling the data... Check your DMs...")
 
     frame_nums = {"day": 1, "week": 7, "month": 30, "year": 365}
     if period == "max":
         df = await unblock_function(ac.get_history, ticker)
     else:
-        start = pd.to_datetime("today") - pd.to_timedelta(frame_nums[period], unit="d")
-        end = pd.to_datetime("today")
-        df = await unblock_function(ac.get_history, ticker, start=start, end=end)
+        # whole days and no end date, so identical requests share one call
+        start = pd.to_datetime("today").normalize() - pd.to_timedelta(
+            frame_nums[period], unit="d"
+        )
+        df = await unblock_function(ac.get_history, ticker, start=start)
     text = df.to_markdown()
 
     # remove the volume column
-    df.drop(columns=["Volume", "Dividends", "Stock Splits"], inplace=True)
+    df = df.drop(columns=["Volume", "Dividends", "Stock Splits"], errors="ignore")
     # get text as pandas plot in Bytes
-    plot = df.plot(title=f"{ticker} History")
-    buffer = BytesIO()
-    plt.savefig(buffer, format="png")
-    buffer.seek(0)
-    plt.close()
+    png = await render_chart(render.frame_chart, df, f"{ticker} History")
+    buffer = BytesIO(png)
 
     files = [
         discord.File(buffer, filename="plot.png"),
         discord.File(BytesIO(str(text).encode()), filename=f"{ticker}_history.txt"),
     ]
     if len(str(text)) > 1950:
-        await ctx.message.author.send(
-            files=files, content=f"[FSD {datetime.now()}] Here's your data: "
+        await send(
+            ctx.message.author,
+            files=files,
+            content=f"[FSD {datetime.now()}] Here's your data: ",
         )
     else:
-        await ctx.message.author.send(
+        await send(
+            ctx.message.author,
             file=files[0],
             content=f"""```{text.strip()}```""",
         )
@@ -152,45 +365,67 @@ async def history(ctx, ticker="AAPL", period="max"):
 
 @bot.command(name="news", help="Returns the news of a stock given ticker")
 async def news(ctx, ticker="AAPL"):
-    await ctx.send("Compiling the data... Check your DMs...")
+    await send(ctx, "Compiling the data... Check your DMs...")
 
     df = await unblock_function(ac.get_news, ticker)
     text = df.to_markdown()
 
     file = discord.File(BytesIO(str(text).encode()), filename=f"{ticker}_news.txt")
     if len(str(text)) > 1950:
-        await ctx.message.author.send(
-            file=file, content=f"[FSD {datetime.now()}] Here's your data: "
+        await send(
+            ctx.message.author,
+            file=file,
+            content=f"[FSD {datetime.now()}] Here's your data: ",
         )
     else:
-        await ctx.message.author.send(f"""```{str(text).strip()}```""")
+        await send(ctx.message.author, f"""```{str(text).strip()}```""")
+
+
+@bot.command(
+    name="sentiment", help="Returns the news sentiment of every watchlist ticker"
+)
+async def sentiment(ctx):
+    # the table is refreshed in the background, this only formats it
+    df = sn.frame()
+    if df.empty:
+        await send(
+            ctx, "The sentiment table isn't ready yet, try again in a few minutes."
+        )
+        return
+    text = df.to_markdown()
+
+    file = discord.File(BytesIO(str(text).encode()), filename="sentiment.txt")
+    await send(
+        ctx.message.author,
+        file=file,
+        content=f"[FSD {datetime.now()}] Here's your data: ",
+    )
 
 
 @bot.command(name="actions", help="Returns the actions of a stock given ticker")
 async def actions(ctx, ticker="AAPL"):
-    await ctx.send("Compiling the data... Check your DMs...")
+    await send(ctx, "Compiling the data... Check your DMs...")
 
     df = await unblock_function(ac.get_actions, ticker)
     text = df.to_markdown()
 
     # get text as pandas plot in Bytes
-    plot = df.plot()
-    title = f"{ticker} Actions"
-    buffer = BytesIO()
-    plt.savefig(buffer, format="png")
-    buffer.seek(0)
-    plt.close()
+    png = await render_chart(render.frame_chart, df, f"{ticker} Actions")
+    buffer = BytesIO(png)
 
     files = [
         discord.File(buffer, filename="plot.png"),
         discord.File(BytesIO(str(text).encode()), filename=f"{ticker}_actions.txt"),
     ]
     if len(str(text)) > 1950:
-        await ctx.message.author.send(
-            files=files, content=f"[FSD {datetime.now()}] Here's your data: "
+        await send(
+            ctx.message.author,
+            files=files,
+            content=f"[FSD {datetime.now()}] Here's your data: ",
         )
     else:
-        await ctx.message.author.send(
+        await send(
+            ctx.message.author,
             files=files[0],
             content=f"""```{text.strip()}```""",
         )
@@ -198,28 +433,28 @@ async def actions(ctx, ticker="AAPL"):
 
 @bot.command(name="dividends", help="Returns the dividends of a stock given ticker")
 async def dividends(ctx, ticker="AAPL"):
-    await ctx.send("Compiling the data... Check your DMs...")
+    await send(ctx, "Compiling the data... Check your DMs...")
 
     df = await unblock_function(ac.get_dividends, ticker)
     text = df.to_markdown()
 
     # get text as pandas plot in Bytes
-    plot = df.plot(title=f"{ticker} Dividends")
-    buffer = BytesIO()
-    plt.savefig(buffer, format="png")
-    buffer.seek(0)
-    plt.close()
+    png = await render_chart(render.frame_chart, df, f"{ticker} Dividends")
+    buffer = BytesIO(png)
 
     files = [
         discord.File(buffer, filename="plot.png"),
         discord.File(BytesIO(str(text).encode()), filename=f"{ticker}_dividends.txt"),
     ]
     if len(str(text)) > 1950:
-        await ctx.message.author.send(
-            files=files, content=f"[FSD {datetime.now()}] Here's your data: "
+        await send(
+            ctx.message.author,
+            files=files,
+            content=f"[FSD {datetime.now()}] Here's your data: ",
         )
     else:
-        await ctx.message.author.send(
+        await send(
+            ctx.message.author,
             files=files[0],
             content=f"""```{text.strip()}```""",
         )
@@ -227,29 +462,28 @@ async def dividends(ctx, ticker="AAPL"):
 
 @bot.command(name="splits", help="Returns the splits of a stock given ticker")
 async def splits(ctx, ticker="AAPL"):
-    await ctx.send("Compiling the data... Check your DMs...")
+    await send(ctx, "Compiling the data... Check your DMs...")
 
     df = await unblock_function(ac.get_splits, ticker)
     text = df.to_markdown()
 
     # get text as pandas plot in Bytes
-    plot = df.plot(title=f"{ticker} Splits")
-    buffer = BytesIO()
-    plt.savefig(buffer, format="png")
-    buffer.seek(0)
-    plt.close()
+    png = await render_chart(render.frame_chart, df, f"{ticker} Splits")
+    buffer = BytesIO(png)
 
     files = [
         discord.File(buffer, filename="plot.png"),
         discord.File(BytesIO(str(text).encode()), filename=f"{ticker}_splits.txt"),
     ]
     if len(str(text)) > 1950:
-        await ctx.message.author.send(
-            files=files, content=f"[FSD {datetime.now()}] Here's your data: "
+        await send(
+            ctx.message.author,
+            files=files,
+            content=f"[FSD {datetime.now()}] Here's your data: ",
         )
     else:
-        await ctx.message.author.send(
-            content=f"""```{text.strip()}```""", file=files[0]
+        await send(
+            ctx.message.author, content=f"""```{text.strip()}```""", file=files[0]
         )
 
 
@@ -258,15 +492,12 @@ async def splits(ctx, ticker="AAPL"):
     help="Predicts the movement of a stock over a given timeframe (day, week, month, year) using ARIMA algorithm",
 )
 async def arima(ctx, ticker="AAPL", col="Close", timeframe="week"):
-    await ctx.send("Crunching the numbers... Check your DMs in a minute...")
+    await send(ctx, "Crunching the numbers... Check your DMs in a minute...")
 
-    fig, df = await unblock_function(sl.arima, ticker, timeframe)
+    png, df = await unblock_function(sl.arima, ticker, timeframe, col)
     text = df.to_markdown()
 
-    buffer = BytesIO()
-    fig.savefig(buffer, format="png")
-    buffer.seek(0)
-    plt.close()
+    buffer = BytesIO(png)
 
     files = [
         discord.File(buffer, filename=f"{ticker}_ARIMA_{col}.png"),
@@ -274,12 +505,14 @@ async def arima(ctx, ticker="AAPL", col="Close", timeframe="week"):
     ]
 
     if len(str(text)) > 1950:
-        await ctx.message.author.send(
-            files=files, content=f"[FSD {datetime.now()}] Here's your data: "
+        await send(
+            ctx.message.author,
+            files=files,
+            content=f"[FSD {datetime.now()}] Here's your data: ",
         )
     else:
-        await ctx.message.author.send(
-            content=f"""```{text.strip()}```""", file=files[0]
+        await send(
+            ctx.message.author, content=f"""```{text.strip()}```""", file=files[0]
         )
 
 
@@ -288,15 +521,12 @@ async def arima(ctx, ticker="AAPL", col="Close", timeframe="week"):
     help="Predicts the movement of a stock over a given timeframe (day, week, month, year) using ETS algorithm",
 )
 async def ets(ctx, ticker="AAPL", col="Close", timeframe="week"):
-    await ctx.send("Crunching the numbers... Check your DMs in a minute...")
+    await send(ctx, "Crunching the numbers... Check your DMs in a minute...")
 
-    fig, df = await unblock_function(sl.ets, ticker, timeframe)
+    png, df = await unblock_function(sl.ets, ticker, timeframe, col)
     text = df.to_markdown()
 
-    buffer = BytesIO()
-    fig.savefig(buffer, format="png")
-    buffer.seek(0)
-    plt.close()
+    buffer = BytesIO(png)
 
     files = [
         discord.File(buffer, filename=f"{ticker}_ETS_{col}.png"),
@@ -304,12 +534,14 @@ async def ets(ctx, ticker="AAPL", col="Close", timeframe="week"):
     ]
 
     if len(str(text)) > 1950:
-        await ctx.message.author.send(
-            files=files, content=f"[FSD {datetime.now()}] Here's your data: "
+        await send(
+            ctx.message.author,
+            files=files,
+            content=f"[FSD {datetime.now()}] Here's your data: ",
         )
     else:
-        await ctx.message.author.send(
-            content=f"""```{text.strip()}```""", file=files[0]
+        await send(
+            ctx.message.author, content=f"""```{text.strip()}```""", file=files[0]
         )
 
 
@@ -318,15 +550,12 @@ async def ets(ctx, ticker="AAPL", col="Close", timeframe="week"):
     help="Predicts the movement of a stock over a given timeframe (day, week, month, year) using CES algorithm",
 )
 async def ces(ctx, ticker="AAPL", col="Close", timeframe="week"):
-    await ctx.send("Crunching the numbers... Check your DMs in a minute...")
+    await send(ctx, "Crunching the numbers... Check your DMs in a minute...")
 
-    fig, df = await unblock_function(sl.ces, ticker, timeframe)
+    png, df = await unblock_function(sl.ces, ticker, timeframe, col)
     text = df.to_markdown()
 
-    buffer = BytesIO()
-    fig.savefig(buffer, format="png")
-    buffer.seek(0)
-    plt.close()
+    buffer = BytesIO(png)
 
     files = [
         discord.File(buffer, filename=f"{ticker}_CES_{col}.png"),
@@ -334,12 +563,14 @@ async def ces(ctx, ticker="AAPL", col="Close", timeframe="week"):
     ]
 
     if len(str(text)) > 1950:
-        await ctx.message.author.send(
-            files=files, content=f"[FSD {datetime.now()}] Here's your data: "
+        await send(
+            ctx.message.author,
+            files=files,
+            content=f"[FSD {datetime.now()}] Here's your data: ",
         )
     else:
-        await ctx.message.author.send(
-            content=f"""```{text.strip()}```""", file=files[0]
+        await send(
+            ctx.message.author, content=f"""```{text.strip()}```""", file=files[0]
         )
 
 
@@ -348,15 +579,12 @@ async def ces(ctx, ticker="AAPL", col="Close", timeframe="week"):
     help="Predicts the movement of a stock over a given timeframe (day, week, month, year) using THETA algorithm",
 )
 async def theta(ctx, ticker="AAPL", col="Close", timeframe="week"):
-    await ctx.send("Crunching the numbers... Check your DMs in a minute...")
+    await send(ctx, "Crunching the numbers... Check your DMs in a minute...")
 
-    fig, df = await unblock_function(sl.theta, ticker, timeframe)
+    png, df = await unblock_function(sl.theta, ticker, timeframe, col)
     text = df.to_markdown()
 
-    buffer = BytesIO()
-    fig.savefig(buffer, format="png")
-    buffer.seek(0)
-    plt.close()
+    buffer = BytesIO(png)
 
     files = [
         discord.File(buffer, filename=f"{ticker}_THETA_{col}.png"),
@@ -364,12 +592,45 @@ async def theta(ctx, ticker="AAPL", col="Close", timeframe="week"):
     ]
 
     if len(str(text)) > 1950:
-        await ctx.message.author.send(
-            files=files, content=f"[FSD {datetime.now()}] Here's your data: "
+        await send(
+            ctx.message.author,
+            files=files,
+            content=f"[FSD {datetime.now()}] Here's your data: ",
+        )
+    else:
+        await send(
+            ctx.message.author, content=f"""```{text.strip()}```""", file=files[0]
+        )
+
+
+@bot.command(
+    name="forecast",
+    help="Predicts the movement of a stock over a given timeframe (day, week, month, year) using ARIMA, ETS, CES and Theta together",
+)
+async def forecast(ctx, ticker="AAPL", col="Close", timeframe="week"):
+    await send(ctx, "Crunching the numbers... Check your DMs in a minute...")
+
+    png, df = await unblock_function(sl.ensemble, ticker, timeframe, col)
+    text = df.to_markdown()
+
+    buffer = BytesIO(png)
+
+    files = [
+        discord.File(buffer, filename=f"{ticker}_ENSEMBLE_{col}.png"),
+        discord.File(
+            BytesIO(str(text).encode()), filename=f"{ticker}_ENSEMBLE_{col}.txt"
+        ),
+    ]
+
+    if len(str(text)) > 1950:
+        await send(
+            ctx.message.author,
+            files=files,
+            content=f"[FSD {datetime.now()}] Here's your data: ",
         )
     else:
-        await ctx.message.author.send(
-            content=f"""```{text.strip()}```""", file=files[0]
+        await send(
+            ctx.message.author, content=f"""```{text.strip()}```""", file=files[0]
         )
 
 
@@ -378,39 +639,26 @@ async def theta(ctx, ticker="AAPL", col="Close", timeframe="week"):
     help="Show the top stocks within the given timeframe (day, week, month, year)",
 )
 async def top(ctx, col="Close", timeframe="week", num=10):
-    await ctx.send("Crunching the numbers... Check your DMs in a minute...")
-
-    avgs = {}
-    for ticker in ac.file_as_list()[:num]:
-        data = await unblock_function(mc.fast_monte_carlo, ticker, timeframe, col)
-        avgs[ticker] = round((data["%change"] * data["increase"]) / 100, 2)
+    await send(ctx, "Crunching the numbers... Check your DMs in a minute...")
 
-    avgs = {
-        k: v for k, v in sorted(avgs.items(), key=lambda item: item[1], reverse=True)
-    }
-    df = pd.DataFrame.from_dict(avgs, orient="index", columns=["Relevancy Score"])
+    # every ticker is downloaded and simulated in one batch
+    scores = await unblock_function(
+        mc.bulk_monte_carlo, ac.file_as_list()[:num], timeframe, col
+    )
+    df = scores.to_frame()
     # set index name
     df.index.name = "Ticker"
     text = df.to_markdown()
 
     # make pie chart
-    fig, ax = plt.subplots()
     nonzero = df[df["Relevancy Score"] >= 0]
-    labels = nonzero.index
-    ax.pie(
-        nonzero["Relevancy Score"],
-        labels=labels,
-        autopct="%1.1f%%",
-        startangle=90,
+    png = await render_chart(
+        render.pie_chart,
+        nonzero["Relevancy Score"].to_numpy(),
+        list(nonzero.index),
+        f"Top {num} stocks for {col} in {timeframe}",
     )
-    ax.axis("equal")  # Equal aspect ratio ensures that pie is drawn as a circle.
-    plt.title(f"Top {num} stocks for {col} in {timeframe}")
-    plt.tight_layout()
-
-    buffer = BytesIO()
-    fig.savefig(buffer, format="png")
-    buffer.seek(0)
-    plt.close()
+    buffer = BytesIO(png)
 
     files = [
         discord.File(buffer, filename=f"Top_{col}.png"),
@@ -418,12 +666,14 @@ async def top(ctx, col="Close", timeframe="week", num=10):
     ]
 
     if len(str(text)) > 1950:
-        await ctx.message.author.send(
-            files=files, content=f"[FSD {datetime.now()}] Here's your data: "
+        await send(
+            ctx.message.author,
+            files=files,
+            content=f"[FSD {datetime.now()}] Here's your data: ",
         )
     else:
-        await ctx.message.author.send(
-            file=files[0], content=f"""```{text.strip()}```"""
+        await send(
+            ctx.message.author, file=files[0], content=f"""```{text.strip()}```"""
         )
 
 
@@ -432,20 +682,21 @@ async def top(ctx, col="Close", timeframe="week", num=10):
     help="Shows the income statement of a company",
 )
 async def income(ctx, ticker="AAPL"):
-    await ctx.send("Crunching the numbers... Check your DMs in a minute...")
+    await send(ctx, "Crunching the numbers... Check your DMs in a minute...")
 
     df = await unblock_function(ac.get_income_stmt, ticker)
     text = df.to_markdown()
 
     if len(str(text)) > 1950:
-        await ctx.message.author.send(
+        await send(
+            ctx.message.author,
             file=discord.File(
                 BytesIO(str(text).encode()), filename=f"{ticker}_Income.txt"
             ),
             content=f"[FSD {datetime.now()}] Here's your data: ",
         )
     else:
-        await ctx.message.author.send(content=f"""```{text.strip()}```""")
+        await send(ctx.message.author, content=f"""```{text.strip()}```""")
 
 
 @bot.command(
@@ -453,20 +704,21 @@ async def income(ctx, ticker="AAPL"):
     help="Shows the cashflow statement of a company",
 )
 async def cashflow(ctx, ticker="AAPL"):
-    await ctx.send("Crunching the numbers... Check your DMs in a minute...")
+    await send(ctx, "Crunching the numbers... Check your DMs in a minute...")
 
     df = await unblock_function(ac.get_cashflow, ticker)
     text = df.to_markdown()
 
     if len(str(text)) > 1950:
-        await ctx.message.author.send(
+        await send(
+            ctx.message.author,
             file=discord.File(
                 BytesIO(str(text).encode()), filename=f"{ticker}_Cashflow.txt"
             ),
             content=f"[FSD {datetime.now()}] Here's your data: ",
         )
     else:
-        await ctx.message.author.send(content=f"""```{text.strip()}```""")
+        await send(ctx.message.author, content=f"""```{text.strip()}```""")
 
 
 @bot.command(
@@ -474,20 +726,17 @@ async def cashflow(ctx, ticker="AAPL"):
     help="Shows the number of shares outstanding of a company",
 )
 async def shares(ctx, ticker="AAPL"):
-    await ctx.send("Crunching the numbers... Check your DMs in a minute...")
+    await send(ctx, "Crunching the numbers... Check your DMs in a minute...")
 
     df = await unblock_function(ac.get_shares, ticker)
-    df.rename(columns={"BasicShares": "Shares Outstanding"}, inplace=True)
+    df = df.rename(columns={"BasicShares": "Shares Outstanding"})
     text = df.to_markdown()
 
     # make plot of shares
-    plot = df.plot()
-    plot.set_title(f"Shares Outstanding for {ticker} by Quarter")
-    fig = plot.get_figure()
-    buffer = BytesIO()
-    fig.savefig(buffer, format="png")
-    buffer.seek(0)
-    plt.close()
+    png = await render_chart(
+        render.frame_chart, df, f"Shares Outstanding for {ticker} by Quarter"
+    )
+    buffer = BytesIO(png)
 
     files = [
         discord.File(buffer, filename=f"{ticker}_Shares.png"),
@@ -495,13 +744,14 @@ async def shares(ctx, ticker="AAPL"):
     ]
 
     if len(str(text)) > 1950:
-        await ctx.message.author.send(
+        await send(
+            ctx.message.author,
             files=files,
             content=f"[FSD {datetime.now()}] Here's your data: ",
         )
     else:
-        await ctx.message.author.send(
-            file=files[0], content=f"""```{text.strip()}```"""
+        await send(
+            ctx.message.author, file=files[0], content=f"""```{text.strip()}```"""
         )
 
 
@@ -510,14 +760,11 @@ async def shares(ctx, ticker="AAPL"):
     help="Predicts the possible movement of a stock over a given timeframe (day, week, month, year) using Monte Carlo algorithm",
 )
 async def monte_carlo(ctx, ticker="AAPL", col="Close", timeframe="week"):
-    await ctx.send("Crunching the numbers... Check your DMs in a minute...")
-    fig, df = await unblock_function(mc.monte_carlo, ticker, timeframe, col)
+    await send(ctx, "Crunching the numbers... Check your DMs in a minute...")
+    png, df = await unblock_function(mc.monte_carlo, ticker, timeframe, col)
     text = df.to_markdown()
 
-    buffer = BytesIO()
-    fig.savefig(buffer, format="png")
-    buffer.seek(0)
-    plt.close()
+    buffer = BytesIO(png)
 
     files = [
         discord.File(buffer, filename=f"{ticker}_Monte_Carlo_{col}.png"),
@@ -527,13 +774,83 @@ async def monte_carlo(ctx, ticker="AAPL", col="Close", timeframe="week"):
     ]
 
     if len(str(text)) > 1950:
-        await ctx.message.author.send(
-            files=files, content=f"[FSD {datetime.now()}] Here's your data: "
+        await send(
+            ctx.message.author,
+            files=files,
+            content=f"[FSD {datetime.now()}] Here's your data: ",
         )
     else:
-        await ctx.message.author.send(
-            content=f"""```{text.strip()}```""", file=files[0]
+        await send(
+            ctx.message.author, content=f"""```{text.strip()}```""", file=files[0]
         )
 
 
-bot.run(TOKEN)
+@bot.command(
+    name="stats", help="Returns the bot's latency and cache metrics (owner only)"
+)
+@commands.is_owner()
+async def stats(ctx):
+    histograms = metrics.summary()
+    gauges = metrics.gauges()
+    text = "\n\n".join(
+        df.round(4).to_markdown(index=False)
+        for df in (histograms, gauges)
+        if not df.empty
+    )
+    if not text:
+        await send(ctx, "Nothing has been measured yet.")
+        return
+
+    file = discord.File(BytesIO(text.encode()), filename="stats.txt")
+    await send(
+        ctx.message.author,
+        file=file,
+        content=f"[FSD {datetime.now()}] Here's your data: ",
+    )
+
+
+@bot.command(
+    name="sync",
+    help="Registers the slash commands with Discord, after they change (owner only)",
+)
+@commands.is_owner()
+async def sync(ctx):
+    # rate limited by discord, so only on request rather than on every start
+    try:
+        synced = await bot.tree.sync()
+    except discord.HTTPException as e:
+        await send(ctx, f"Syncing failed: {e}")
+        return
+    await send(ctx, f"Synced {len(synced)} slash commands.")
+
+
+@bot.command(
+    name="profile",
+    help="Profiles the next n runs of a command, 0 turns it off (owner only)",
+)
+@commands.is_owner()
+async def profile(ctx, command=None, n: int = 1):
+    if command is None:
+        armed = ", ".join(f"{name} x{left}" for name, left in profiler.armed.items())
+        await send(ctx, f"Profiling: {armed or 'nothing'}")
+        return
+    if bot.get_command(command) is None:
+        raise commands.BadArgument(f"There is no {command} command.")
+    profiler.arm(command, n)
+    if n <= 0:
+        await send(ctx, f"Stopped profiling {command}.")
+        return
+    # jobs handed to `python worker.py` processes aren't sampled
+    note = (
+        " Worker mode is on, queued jobs aren't profiled." if CONFIG.WORKER_MODE else ""
+    )
+    await send(
+        ctx,
+        f"Profiling the next {n} runs of {command}, folded stacks go to {CONFIG.PROFILE_DIR}.{note}",
+    )
+
+
+# guarded so the render worker processes can import this module without starting the bot
+if __name__ == "__main__":
+    bot.run(TOKEN)
+
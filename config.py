@@ -1,2 +1,85 @@
 CHANNEL_ID = 1073088727028600904
-THRESHOLD = 45.0
\ No newline at end of file
+THRESHOLD = 45.0
+
+# local OHLCV history store (see discord_actions/store.py)
+HISTORY_DIR = "data/history"
+# seconds before a stored ticker is checked for new bars again
+HISTORY_REFRESH = 15 * 60
+
+# cache for yfinance metadata endpoints (see discord_actions/cache.py)
+CACHE_SIZE = 512
+# set to None to keep the cache in memory only
+CACHE_DIR = "data/cache"
+# files kept on disk, least recently used are deleted first
+CACHE_DISK_SIZE = 4096
+
+# finished forecasts (see algorithms/singleline.py)
+FORECAST_CACHE_SIZE = 256
+FORECAST_CACHE_DIR = "data/forecast_cache"
+FORECAST_CACHE_DISK_SIZE = 2048
+
+# processes drawing charts (see discord_actions/render.py)
+RENDER_WORKERS = 2
+
+# compiled numba kernels for statsforecast, reused across restarts
+NUMBA_CACHE_DIR = "data/numba"
+
+# executor sizes and queue bounds (see discord_actions/scheduler.py),
+# commands get a "busy" reply once a queue is full
+IO_WORKERS = 8
+IO_QUEUE = 64
+CPU_WORKERS = 2
+CPU_QUEUE = 16
+# scheduling priority by function name, 0 runs first and 1 is the default
+PRIORITIES = {"bulk_monte_carlo": 2, "warmup": 2}
+
+# distributed mode: commands only queue their work and `python worker.py`
+# processes run it (see discord_actions/jobs.py)
+WORKER_MODE = False
+JOBS_DB = "data/jobs.sqlite3"
+# seconds between result checks, seconds the bot waits for a job (older rows
+# are dropped), seconds a job may wait for a worker to claim it
+JOBS_POLL = 0.25
+JOBS_TIMEOUT = 15 * 60
+JOBS_CLAIM_TIMEOUT = 60
+# workers renew their claim every JOBS_HEARTBEAT seconds; a job whose claim is
+# JOBS_LEASE seconds old is retried, up to JOBS_ATTEMPTS runs in all
+JOBS_HEARTBEAT = 5
+JOBS_LEASE = 30
+JOBS_ATTEMPTS = 2
+
+# movers alerts (see algorithms/movers.py): a symbol already alerted today is only
+# alerted again after moving REALERT_STEP more percentage points
+REALERT_STEP = 10.0
+MOVERS_STATE = "data/movers_state.json"
+
+# symbol directory (see discord_actions/symbols.py)
+SYMBOLS_FILE = "nasdaqtraded.txt"
+SYMBOLS_INDEX = "data/symbols.npz"
+# watchlist used by ?top, ordered by market cap
+WATCHLIST = "tickers.txt"
+
+# news sentiment (see algorithms/sentiment.py): headline scores kept in memory,
+# the watchlist's table refreshed every SENTIMENT_REFRESH seconds
+SENTIMENT_CACHE_SIZE = 20000
+SENTIMENT_REFRESH = 30 * 60
+
+# offline benchmark (see benchmark.py): recorded market data and saved runs
+BENCH_FIXTURES = "benchmarks/fixtures"
+BENCH_RESULTS = "data/benchmarks"
+
+# market data source (see discord_actions/providers.py): "yfinance", or "local" to
+# replay the recordings in BENCH_FIXTURES without a network
+PROVIDER = "yfinance"
+# parallel requests of a provider's bulk calls
+PROVIDER_WORKERS = 8
+
+# Prometheus metrics on http://METRICS_HOST:METRICS_PORT/metrics (see
+# discord_actions/metrics.py), a falsy port turns the endpoint off
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+
+# ?profile (see discord_actions/profiler.py): folded stacks for flamegraphs, and
+# the seconds between stack samples
+PROFILE_DIR = "data/profiles"
+PROFILE_INTERVAL = 0.005
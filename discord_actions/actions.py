@@ -2,14 +2,19 @@ import sys
 
 sys.path.append("..")
 
-import yfinance as yf
+import numpy as np
 import pandas as pd
 import algorithms.sentiment as sn
+import discord_actions.providers as providers
+import discord_actions.store as store
+import discord_actions.symbols as symbols
 
 
 def file_as_list(filename="tickers.txt"):
     with open(filename) as f:
-        return f.read().split("\n")
+        tickers = f.read().split("\n")
+    # drop blank lines and symbols the directory doesn't list (delisted, typos)
+    return [ticker for ticker in tickers if ticker and symbols.is_known(ticker)]
 
 
 def get_news(ticker):
@@ -25,38 +30,34 @@ def get_news(ticker):
 
 
 def get_sentiment(ticker):
-    sentiment = sn.sentimentv2(ticker)
+    # the watchlist's scores are kept fresh in the background
+    sentiment = sn.lookup(ticker)
     return sentiment
 
 
 def get_info(ticker):
-    _ticker = yf.Ticker(ticker)
-    info = _ticker.info
+    info = providers.current().get(ticker, "info")
 
     return [info, get_sentiment(ticker)]
 
 
 def get_calendar(ticker):
-    _ticker = yf.Ticker(ticker)
-    calendar = _ticker.calendar
+    calendar = providers.current().get(ticker, "calendar")
     return calendar
 
 
 def get_income_stmt(ticker):
-    _ticker = yf.Ticker(ticker)
-    income = _ticker.income_stmt
+    income = providers.current().get(ticker, "income_stmt")
     return income
 
 
 def get_cashflow(ticker):
-    _ticker = yf.Ticker(ticker)
-    cashflow = _ticker.cashflow
+    cashflow = providers.current().get(ticker, "cashflow")
     return cashflow
 
 
 def get_shares(ticker):
-    _ticker = yf.Ticker(ticker)
-    shares = _ticker.shares
+    shares = providers.current().get(ticker, "shares")
     return shares
 
 
@@ -64,24 +65,26 @@ def get_history(ticker, **kwargs):
     # extraxt start and end dates from kwargs
     start = kwargs.get("start", None)
     end = kwargs.get("end", None)
-    _ticker = yf.Ticker(ticker)
-    # get historical market data
-    if start and end:
-        hist = _ticker.history(start=start, end=end)
-    else:
-        hist = _ticker.history(period="max")
+    columns = kwargs.get("columns", None)
+    # served from the local store, which only downloads bars it doesn't have yet
+    return store.get_history(ticker, start=start, end=end, columns=columns)
+
+
+def get_history_bulk(tickers, **kwargs):
+    # one bulk request for many tickers, columns are (field, ticker)
+    start = kwargs.get("start", None)
+    end = kwargs.get("end", None)
+    hist = providers.current().history_bulk(list(tickers), start=start, end=end)
     return hist
 
 
 def get_actions(ticker):
-    _ticker = yf.Ticker(ticker)
-    actions = _ticker.actions
+    actions = providers.current().get(ticker, "actions")
     return actions
 
 
 def get_dividends(ticker):
-    _ticker = yf.Ticker(ticker)
-    dividends = _ticker.dividends
+    dividends = providers.current().get(ticker, "dividends")
     return dividends
 
 
@@ -91,8 +94,7 @@ def get_experts(ticker, frame):
     num_days = frame_nums.get(frame)
     start = pd.Timestamp.today() - pd.Timedelta(days=num_days)
     end = pd.Timestamp.today()
-    _ticker = yf.Ticker(ticker)
-    experts = _ticker.recommendations
+    experts = providers.current().get(ticker, "recommendations")
     # filter the dataframe
     experts = experts[(experts.index >= start) & (experts.index <= end)]
 
@@ -100,22 +102,41 @@ def get_experts(ticker, frame):
 
 
 def get_sustainability(ticker):
-    _ticker = yf.Ticker(ticker)
-    sustainability = _ticker.sustainability
+    sustainability = providers.current().get(ticker, "sustainability")
     return sustainability
 
 
 def get_splits(ticker):
-    _ticker = yf.Ticker(ticker)
-    splits = _ticker.splits
+    splits = providers.current().get(ticker, "splits")
     return splits
 
 
-def history_to_sf(ticker, metric):
-    hist = get_history(ticker).tail(int(365.25 * 10))
-    # iterate over the dataframe
-    unique_id = ["ID" for i in range(len(hist))]
-    ds = [date for date in hist.index]
-    y = [metric for metric in hist[metric]]
-    df = pd.DataFrame(list(zip(unique_id, ds, y)), columns=["unique_id", "ds", "y"])
-    return df
+def history_to_sf(ticker, metric, bars=None):
+    if bars is None:
+        # no window given, use the last ten years
+        hist = get_history(ticker, columns=[metric]).tail(int(365.25 * 10))
+    else:
+        # about 252 trading days a year, sized for 245 so holidays never cut it short
+        start = pd.Timestamp.today().normalize() - pd.Timedelta(
+            days=bars * 365 // 245 + 14
+        )
+        hist = get_history(ticker, start=start, columns=[metric])
+    # zero prices are bad ticks, drop them before taking the window
+    y = hist[metric]
+    y = y[y != 0]
+    if bars is not None and len(y) < bars:
+        # long closures or many bad ticks, fall back to everything stored
+        y = get_history(ticker, columns=[metric])[metric]
+        y = y[y != 0]
+    if bars is not None:
+        y = y.tail(bars)
+    # built from whole columns, unique_id as a single-category column
+    return pd.DataFrame(
+        {
+            "unique_id": pd.Categorical.from_codes(
+                np.zeros(len(y), dtype=np.int8), categories=["ID"]
+            ),
+            "ds": y.index,
+            "y": y.to_numpy(),
+        }
+    )
@@ -0,0 +1,174 @@
+"""
+TTL + LRU cache for data that changes far less often than it is requested.
+
+Entries live in memory up to `maxsize` and are evicted least recently used
+first. With a directory set, entries are also pickled to disk so they survive
+restarts; an entry is served until its TTL runs out in either tier. The disk
+tier is capped at `disk_maxsize` files, least recently used (by mtime) first,
+and expired files are deleted when they are read.
+"""
+
+import copy
+import hashlib
+import os
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+sys.path.append("..")
+import config as CONFIG
+
+# every named cache, for the metrics
+caches = {}
+# files written between two scans of the disk tier
+PRUNE_EVERY = 32
+
+
+class TTLCache:
+    def __init__(self, maxsize, directory=None, name=None, disk_maxsize=None):
+        if name is not None:
+            caches[name] = self
+        self.maxsize = maxsize
+        self.directory = directory
+        self.disk_maxsize = disk_maxsize or 4 * maxsize
+        self.dumps = 0
+        self.entries = OrderedDict()
+        # name -> [hits, misses]
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def _path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.pkl")
+
+    def _count(self, name, hit):
+        with self.lock:
+            self.counts.setdefault(name, [0, 0])[0 if hit else 1] += 1
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                stored_key, expires, value = pickle.load(f)
+        except (
+            OSError,
+            pickle.PickleError,
+            EOFError,
+            ValueError,
+            AttributeError,
+            ImportError,
+        ):
+            return None
+        # a hash collision is treated as a miss, a stale file is deleted
+        if stored_key != key:
+            return None
+        if expires < time.time():
+            self._remove(path)
+            return None
+        # mark it recently used for _prune
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return expires, value
+
+    def _dump(self, key, expires, value):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump((key, expires, value), f)
+            os.replace(tmp, path)
+        except (OSError, pickle.PickleError, TypeError, AttributeError):
+            # values that can't be pickled just stay memory only
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        with self.lock:
+            self.dumps += 1
+            due = self.dumps % PRUNE_EVERY == 1
+        if due:
+            self._prune()
+
+    def _prune(self):
+        # keep the disk_maxsize most recently used files
+        files = []
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".pkl"):
+                        try:
+                            files.append((entry.stat().st_mtime, entry.path))
+                        except OSError:
+                            pass
+        except OSError:
+            return
+        if len(files) <= self.disk_maxsize:
+            return
+        files.sort()
+        for _, path in files[: len(files) - self.disk_maxsize]:
+            self._remove(path)
+
+    def get(self, key, name=None, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is None and self.directory:
+            entry = self._load(key)
+            if entry is not None:
+                self._remember(key, *entry)
+        if name is not None:
+            self._count(name, entry is not None)
+        if entry is None:
+            return default
+        # hand out copies so callers can't mutate the cached value
+        return copy.deepcopy(entry[1])
+
+    def _remember(self, key, expires, value):
+        with self.lock:
+            self.entries[key] = (expires, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def put(self, key, value, ttl):
+        expires = time.time() + ttl
+        value = copy.deepcopy(value)
+        self._remember(key, expires, value)
+        if self.directory:
+            self._dump(key, expires, value)
+
+    def stats(self):
+        with self.lock:
+            return {
+                name: {
+                    "hits": hits,
+                    "misses": misses,
+                    "ratio": hits / (hits + misses) if hits + misses else 0.0,
+                }
+                for name, (hits, misses) in self.counts.items()
+            }
+
+
+# returned by get() on a miss when None is a legitimate cached value
+MISSING = object()
+
+metadata = TTLCache(
+    CONFIG.CACHE_SIZE,
+    CONFIG.CACHE_DIR,
+    name="metadata",
+    disk_maxsize=CONFIG.CACHE_DISK_SIZE,
+)
@@ -0,0 +1,302 @@
+"""
+Durable job queue for the bot's distributed mode (CONFIG.WORKER_MODE).
+
+The bot enqueues each ac.*/mc.*/sl.* call as a row in a SQLite database and
+waits for the result; any number of `python worker.py` processes claim rows,
+run them and write the result back. A worker renews a lease on its job every
+JOBS_HEARTBEAT seconds, so the job of a worker that died is picked up again
+once the lease runs out (JOBS_LEASE), well before the bot stops waiting.
+Single host only: SQLite in WAL mode
+needs every process on the machine that holds the database, so don't put
+it on a network filesystem.
+
+Arguments are stored as JSON and workers only run the functions in
+FUNCTIONS. Results are pickled, so workers sign them with the JOBS_SECRET
+environment variable and the bot only unpickles results that carry a valid
+signature.
+"""
+
+import asyncio
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+sys.path.append("..")
+import config as CONFIG
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    command TEXT NOT NULL,
+    ticker TEXT,
+    args BLOB NOT NULL,
+    reply_to INTEGER,
+    status TEXT NOT NULL DEFAULT 'queued',
+    result BLOB,
+    worker TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    heartbeat REAL,
+    attempts INTEGER NOT NULL DEFAULT 0
+)
+"""
+# columns added after the first release, for databases created before them
+COLUMNS = {"heartbeat": "REAL", "attempts": "INTEGER NOT NULL DEFAULT 0"}
+
+# the only functions a worker will run, as "module:function"
+FUNCTIONS = {
+    *(
+        f"discord_actions.actions:{name}"
+        for name in [
+            "get_info",
+            "get_calendar",
+            "get_experts",
+            "get_sustainability",
+            "get_history",
+            "get_news",
+            "get_actions",
+            "get_dividends",
+            "get_splits",
+            "get_income_stmt",
+            "get_cashflow",
+            "get_shares",
+        ]
+    ),
+    *(
+        f"algorithms.singleline:{name}"
+        for name in ["arima", "ets", "ces", "theta", "ensemble"]
+    ),
+    "algorithms.montecarlo:monte_carlo",
+    "algorithms.montecarlo:bulk_monte_carlo",
+}
+
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+_local = threading.local()
+_schema_lock = threading.Lock()
+_schema_ready = False
+# the bot's database calls, one thread with one connection so the loop never blocks
+_db_thread = ThreadPoolExecutor(1, thread_name_prefix="jobs")
+
+
+class JobFailed(Exception):
+    pass
+
+
+class JobTimeout(JobFailed):
+    pass
+
+
+def connection():
+    # one connection per thread, kept open; sqlite connections can't be shared across threads
+    global _schema_ready
+    db = getattr(_local, "db", None)
+    if db is None:
+        os.makedirs(os.path.dirname(CONFIG.JOBS_DB) or ".", exist_ok=True)
+        db = sqlite3.connect(CONFIG.JOBS_DB, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        with _schema_lock:
+            if not _schema_ready:
+                # WAL is stored in the database file, so once is enough
+                db.execute("PRAGMA journal_mode=WAL")
+                db.execute(SCHEMA)
+                existing = {
+                    row["name"] for row in db.execute("PRAGMA table_info(jobs)")
+                }
+                for column, kind in COLUMNS.items():
+                    if column not in existing:
+                        db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+                _schema_ready = True
+        _local.db = db
+    return db
+
+
+def command_name(fn):
+    return f"{fn.__module__}:{fn.__qualname__}"
+
+
+def _encode(value):
+    # the commands pass timestamps as start dates, the store parses them back
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} can't be queued as a job argument")
+
+
+def dumps_args(args, kwargs):
+    return json.dumps({"args": list(args), "kwargs": kwargs}, default=_encode)
+
+
+def loads_args(text):
+    data = json.loads(text)
+    return data["args"], data["kwargs"]
+
+
+def _secret():
+    secret = os.getenv("JOBS_SECRET")
+    if not secret:
+        raise JobFailed("JOBS_SECRET must be set in worker mode")
+    return secret.encode()
+
+
+def sign(result):
+    payload = pickle.dumps(result)
+    return hmac.new(_secret(), payload, hashlib.sha256).digest() + payload
+
+
+def verify(blob):
+    # unpickle only what a worker holding the secret signed
+    signature, payload = blob[:DIGEST_SIZE], blob[DIGEST_SIZE:]
+    expected = hmac.new(_secret(), payload, hashlib.sha256).digest()
+    if not hmac.compare_digest(signature, expected):
+        raise JobFailed("job result has a bad signature")
+    return pickle.loads(payload)
+
+
+def enqueue(command, args, reply_to=None, ticker=None):
+    cursor = connection().execute(
+        "INSERT INTO jobs (command, ticker, args, reply_to, created) VALUES (?, ?, ?, ?, ?)",
+        (command, ticker, args, reply_to, time.time()),
+    )
+    return cursor.lastrowid
+
+
+def claim(worker):
+    db = connection()
+    now = time.time()
+    expired = now - CONFIG.JOBS_LEASE
+    # take the write lock first so two workers can't claim the same row
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        # the bot has stopped waiting for these (or restarted since), nobody reads them
+        db.execute("DELETE FROM jobs WHERE created < ?", (now - CONFIG.JOBS_TIMEOUT,))
+        # a job whose workers keep dying (out of memory, say) isn't tried forever
+        db.execute(
+            """
+            UPDATE jobs SET status = 'failed', result = ?, finished = ?
+            WHERE status = 'running' AND heartbeat < ? AND attempts >= ?
+            """,
+            (b"the worker running this job died", now, expired, CONFIG.JOBS_ATTEMPTS),
+        )
+        # a running job whose lease ran out belonged to a worker that died
+        row = db.execute(
+            """
+            SELECT * FROM jobs
+            WHERE status = 'queued' OR (status = 'running' AND heartbeat < ?)
+            ORDER BY id LIMIT 1
+            """,
+            (expired,),
+        ).fetchone()
+        if row is not None:
+            db.execute(
+                """
+                UPDATE jobs SET status = 'running', worker = ?, started = ?,
+                    heartbeat = ?, attempts = attempts + 1
+                WHERE id = ?
+                """,
+                (worker, now, now, row["id"]),
+            )
+        db.execute("COMMIT")
+    except BaseException:
+        db.execute("ROLLBACK")
+        raise
+    return row
+
+
+@contextmanager
+def lease(job_id, worker):
+    # renew the claim on job_id from another thread while the job runs
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(CONFIG.JOBS_HEARTBEAT):
+            connection().execute(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ?",
+                (time.time(), job_id, worker),
+            )
+
+    thread = threading.Thread(target=renew, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _complete(job_id, status, result):
+    connection().execute(
+        "UPDATE jobs SET status = ?, result = ?, finished = ? WHERE id = ?",
+        (status, result, time.time(), job_id),
+    )
+
+
+def finish(job_id, result):
+    _complete(job_id, "done", sign(result))
+
+
+def fail(job_id, error):
+    _complete(job_id, "failed", error.encode())
+
+
+def _poll(job_id):
+    return (
+        connection()
+        .execute("SELECT status, result FROM jobs WHERE id = ?", (job_id,))
+        .fetchone()
+    )
+
+
+def delete(job_id):
+    connection().execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+
+async def _call(fn, *args):
+    return await asyncio.get_event_loop().run_in_executor(_db_thread, fn, *args)
+
+
+async def wait(job_id):
+    # a job nobody claims in JOBS_CLAIM_TIMEOUT means no worker is running
+    created = time.monotonic()
+    deadline = created + CONFIG.JOBS_TIMEOUT
+    try:
+        while True:
+            row = await _call(_poll, job_id)
+            if row is None:
+                raise JobFailed(f"job {job_id} disappeared from the queue")
+            if row["status"] in ("done", "failed"):
+                # the result has been handed over, the row isn't needed anymore
+                await _call(delete, job_id)
+                if row["status"] == "failed":
+                    raise JobFailed(row["result"].decode())
+                return verify(row["result"])
+            now = time.monotonic()
+            if row["status"] == "queued" and now - created > CONFIG.JOBS_CLAIM_TIMEOUT:
+                raise JobTimeout("no worker picked up the job")
+            if now > deadline:
+                raise JobTimeout("the job took too long")
+            await asyncio.sleep(CONFIG.JOBS_POLL)
+    except (JobTimeout, asyncio.CancelledError):
+        # nobody will read the result, so don't leave the row behind;
+        # submitted rather than awaited, a cancelled task can't await
+        _db_thread.submit(delete, job_id)
+        raise
+
+
+async def submit(fn, *args, reply_to=None, **kwargs):
+    # fail now rather than after a worker has done the work
+    _secret()
+    ticker = args[0] if args and isinstance(args[0], str) else None
+    job_id = await _call(
+        enqueue, command_name(fn), dumps_args(args, kwargs), reply_to, ticker
+    )
+    return await wait(job_id)
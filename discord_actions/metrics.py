@@ -0,0 +1,240 @@
+"""
+In-process metrics, served in the Prometheus text format.
+
+Histograms time the stages of every command (queue wait, executor call,
+fetch, render, send) and collectors report live values such as queue depths
+and cache hit ratios when scraped. Calls in the CPU pool record their
+observations (fetch, render) in the worker process and send them back with
+the result, see measured() and merge(). Work done by `python worker.py` only
+shows up as the time of the call that waited for it, and collectors only see
+the bot process.
+"""
+
+import bisect
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+sys.path.append("..")
+import config as CONFIG
+
+PREFIX = "bot_"
+# upper bounds in seconds, from a cached lookup to a slow yearly forecast
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+HELP = {
+    "command_seconds": "Time from invoking a command to its last reply",
+    "send_seconds": "Time a command spent sending messages to Discord",
+    "format_seconds": "Time a command spent outside the executors, the render pool and Discord calls, mostly formatting",
+    "unblock_seconds": "Time a command waited on an executor call, queueing included",
+    "queue_wait_seconds": "Time a call waited in its executor lane's queue",
+    "call_seconds": "Time a call ran in its executor lane",
+    "fetch_seconds": "Time a market data request took",
+    "render_seconds": "Time a chart took to render",
+    "movers_sweep_seconds": "Time a full movers sweep took",
+}
+
+_lock = threading.Lock()
+# name -> {labels: [bucket counts..., sum, count]}
+histograms = {}
+# name -> (help, kind, fn returning {labels: value})
+collectors = {}
+# set on the first serve() so a second call doesn't bind the port twice
+_runner = None
+# .observations is a list while measured() runs a call on this thread
+_local = threading.local()
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def observe(name, seconds, **labels):
+    captured = getattr(_local, "observations", None)
+    if captured is not None:
+        # a worker process, the bot records these in merge()
+        captured.append((name, seconds, labels))
+        return
+    key = _labels(labels)
+    with _lock:
+        series = histograms.setdefault(name, {})
+        counts = series.get(key)
+        if counts is None:
+            counts = series[key] = [0] * len(BUCKETS) + [0.0, 0]
+        i = bisect.bisect_left(BUCKETS, seconds)
+        if i < len(BUCKETS):
+            counts[i] += 1
+        counts[-2] += seconds
+        counts[-1] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def measured(func):
+    # run func() in a worker process, returning what it observed along with its outcome
+    _local.observations = []
+    try:
+        return func(), None, _local.observations
+    except Exception as e:
+        return None, e, _local.observations
+    finally:
+        _local.observations = None
+
+
+def merge(result, error, observations):
+    # record a measured() call's observations here, then hand back its outcome
+    for name, seconds, labels in observations:
+        observe(name, seconds, **labels)
+    if error is not None:
+        raise error
+    return result
+
+
+def collector(name, help, fn, kind="gauge"):
+    # fn() -> {labels dict as a tuple of pairs: value}, called on every scrape
+    collectors[name] = (help, kind, fn)
+
+
+def function_name(fn):
+    # actions.get_info, montecarlo.monte_carlo, ...
+    return f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__qualname__}"
+
+
+def _format_labels(key, extra=()):
+    pairs = [*key, *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def render():
+    lines = []
+    with _lock:
+        snapshot = {
+            name: {key: list(counts) for key, counts in series.items()}
+            for name, series in histograms.items()
+        }
+    for name, series in sorted(snapshot.items()):
+        full = PREFIX + name
+        lines.append(f"# HELP {full} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {full} histogram")
+        for key, counts in series.items():
+            cumulative = 0
+            for bound, count in zip(BUCKETS, counts):
+                cumulative += count
+                labels = _format_labels(key, [("le", bound)])
+                lines.append(f"{full}_bucket{labels} {cumulative}")
+            labels = _format_labels(key, [("le", "+Inf")])
+            lines.append(f"{full}_bucket{labels} {counts[-1]}")
+            lines.append(f"{full}_sum{_format_labels(key)} {counts[-2]}")
+            lines.append(f"{full}_count{_format_labels(key)} {counts[-1]}")
+    for name, (help, kind, fn) in sorted(collectors.items()):
+        full = PREFIX + name
+        lines.append(f"# HELP {full} {help}")
+        lines.append(f"# TYPE {full} {kind}")
+        for key, value in fn().items():
+            lines.append(f"{full}{_format_labels(key)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def _quantile(counts, q):
+    # upper bound of the bucket holding the q quantile, like histogram_quantile()
+    total = counts[-1]
+    if not total:
+        return float("nan")
+    cumulative = 0
+    for bound, count in zip(BUCKETS, counts):
+        cumulative += count
+        if cumulative >= q * total:
+            return bound
+    return float("inf")
+
+
+def summary():
+    # one row per histogram series, for ?stats
+    import pandas as pd
+
+    rows = []
+    with _lock:
+        for name, series in sorted(histograms.items()):
+            for key, counts in series.items():
+                rows.append(
+                    {
+                        "metric": name,
+                        "labels": ",".join(f"{k}={v}" for k, v in key),
+                        "count": counts[-1],
+                        "mean": counts[-2] / counts[-1] if counts[-1] else 0.0,
+                        "p50<=": _quantile(counts, 0.5),
+                        "p95<=": _quantile(counts, 0.95),
+                    }
+                )
+    return pd.DataFrame(rows)
+
+
+def gauges():
+    # current value of every collector, for ?stats
+    import pandas as pd
+
+    rows = []
+    for name, (_, _, fn) in sorted(collectors.items()):
+        for key, value in fn().items():
+            labels = ",".join(f"{k}={v}" for k, v in key)
+            rows.append({"metric": name, "labels": labels, "value": value})
+    return pd.DataFrame(rows)
+
+
+def _cache_ratios():
+    from discord_actions.cache import caches
+
+    return {
+        (("cache", cache), ("name", name)): counts["ratio"]
+        for cache, ttl_cache in caches.items()
+        for name, counts in ttl_cache.stats().items()
+    }
+
+
+def _cache_requests():
+    from discord_actions.cache import caches
+
+    return {
+        (("cache", cache), ("name", name), ("result", result)): counts[result]
+        for cache, ttl_cache in caches.items()
+        for name, counts in ttl_cache.stats().items()
+        for result in ("hits", "misses")
+    }
+
+
+collector("cache_hit_ratio", "Share of cache lookups that were hits", _cache_ratios)
+collector("cache_requests_total", "Cache lookups by result", _cache_requests, "counter")
+
+
+async def serve():
+    # localhost only by default, the numbers aren't meant for the outside
+    global _runner
+    if _runner is not None or not CONFIG.METRICS_PORT:
+        return
+    from aiohttp import web
+
+    async def metrics(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, CONFIG.METRICS_HOST, CONFIG.METRICS_PORT).start()
+    except OSError as e:
+        # port taken (another instance?), the bot runs fine without the endpoint
+        print(f"Metrics endpoint not started: {e!r}")
+        await runner.cleanup()
+        return
+    _runner = runner
+    print(f"Metrics on http://{CONFIG.METRICS_HOST}:{CONFIG.METRICS_PORT}/metrics")
@@ -0,0 +1,91 @@
+"""
+On-demand sampling profiler for the executor work of chosen commands.
+
+`?profile arima 3` arms the next three ?arima invocations. Their ac.*/mc.*/sl.*
+calls then run with a thread sampling the calling thread's stack every
+CONFIG.PROFILE_INTERVAL seconds, in whichever process runs them, and the
+samples are written to CONFIG.PROFILE_DIR in the folded format that
+flamegraph.pl, speedscope and inferno read. Unarmed calls only pay for one
+ContextVar lookup.
+"""
+
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+sys.path.append("..")
+import config as CONFIG
+import discord_actions.metrics as metrics
+
+# output name prefix of the invocation being profiled, None when it isn't
+active = contextvars.ContextVar("profile", default=None)
+# command name -> invocations left to profile
+armed = {}
+_lock = threading.Lock()
+
+
+def arm(command, times):
+    with _lock:
+        if times > 0:
+            armed[command] = times
+        else:
+            armed.pop(command, None)
+
+
+def take(command):
+    # output prefix if this invocation of command is to be profiled
+    if command not in armed:
+        return None
+    with _lock:
+        left = armed.get(command, 0)
+        if left <= 0:
+            return None
+        if left == 1:
+            del armed[command]
+        else:
+            armed[command] = left - 1
+    return f"{command}-{time.strftime('%Y%m%d-%H%M%S')}-{left}"
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return (
+        f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    )
+
+
+def _sample(thread_id, stop, samples):
+    while not stop.wait(CONFIG.PROFILE_INTERVAL):
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        # only the frames below call(), the executor's own frames are the same every time
+        while frame is not None and frame.f_code is not call.__code__:
+            stack.append(_frame_name(frame))
+            frame = frame.f_back
+        if stack:
+            samples[";".join(reversed(stack))] += 1
+
+
+def call(prefix, func):
+    # run func (a functools.partial) while sampling this thread
+    samples = Counter()
+    stop = threading.Event()
+    sampler = threading.Thread(
+        target=_sample, args=(threading.get_ident(), stop, samples), daemon=True
+    )
+    sampler.start()
+    try:
+        return func()
+    finally:
+        stop.set()
+        sampler.join()
+        name = metrics.function_name(func.func)
+        os.makedirs(CONFIG.PROFILE_DIR, exist_ok=True)
+        # appended, so repeated calls within one invocation add up
+        path = os.path.join(CONFIG.PROFILE_DIR, f"{prefix}-{name}.folded")
+        with open(path, "a") as f:
+            for stack, count in samples.items():
+                f.write(f"{stack} {count}\n")
@@ -0,0 +1,338 @@
+"""
+Market data providers.
+
+Everything the bot reads from the market goes through a provider:
+
+    get(ticker, field)         one yf.Ticker attribute (info, news, dividends, ...)
+    fields(tickers, field)     the same attribute for many tickers
+    history(ticker, start)     daily OHLCV bars, all of them without a start
+    history_bulk(tickers, ...) daily bars of many tickers, columns are (field, ticker)
+    quotes(tickers)            live quotes, async
+
+YFinanceProvider talks to Yahoo, LocalProvider replays recordings from disk
+(no network needed) and CachingProvider wraps either one with the TTL cache.
+CONFIG.PROVIDER picks the source of current().
+"""
+
+import abc
+import asyncio
+import copy
+import json
+import os
+import pickle
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+import pandas as pd
+import yfinance as yf
+
+sys.path.append("..")
+import config as CONFIG
+import discord_actions.metrics as metrics
+from discord_actions.cache import MISSING, metadata
+
+# how long each field is reused before it is fetched again, in seconds
+MINUTE = 60
+HOUR = 60 * MINUTE
+DAY = 24 * HOUR
+TTLS = {
+    "info": 15 * MINUTE,
+    "news": 10 * MINUTE,
+    "calendar": 6 * HOUR,
+    "recommendations": 6 * HOUR,
+    "income_stmt": DAY,
+    "cashflow": DAY,
+    "shares": DAY,
+    "actions": DAY,
+    "dividends": DAY,
+    "splits": DAY,
+    "sustainability": 7 * DAY,
+}
+# bulk history is requested by day, so it can be shared for a while
+HISTORY_BULK_TTL = 15 * MINUTE
+
+provider = None
+_provider_lock = threading.Lock()
+
+
+class Provider(abc.ABC):
+    @abc.abstractmethod
+    def get(self, ticker, field):
+        pass
+
+    def fields(self, tickers, field):
+        # {ticker: value}, fetched in parallel by default; a ticker that fails is left out
+        def fetch(ticker):
+            try:
+                return ticker, self.get(ticker, field)
+            except Exception as e:
+                print(f"{field} for {ticker} failed: {e!r}")
+                return ticker, MISSING
+
+        with ThreadPoolExecutor(CONFIG.PROVIDER_WORKERS) as pool:
+            fetched = pool.map(fetch, tickers)
+        return {ticker: value for ticker, value in fetched if value is not MISSING}
+
+    @abc.abstractmethod
+    def history(self, ticker, start=None):
+        pass
+
+    @abc.abstractmethod
+    def history_bulk(self, tickers, start=None, end=None):
+        pass
+
+    @abc.abstractmethod
+    async def quotes(self, tickers):
+        pass
+
+
+class YFinanceProvider(Provider):
+    # symbols per quote request (browser URI limit is 2000)
+    BATCH_SIZE = 1900
+    # quote requests in flight at once, seconds per request, attempts per batch
+    CONCURRENCY = 4
+    TIMEOUT = 30
+    RETRIES = 3
+
+    def __init__(self):
+        self.session = None
+
+    def get(self, ticker, field):
+        return getattr(yf.Ticker(ticker), field)
+
+    def history(self, ticker, start=None):
+        _ticker = yf.Ticker(ticker)
+        if start is None:
+            return _ticker.history(period="max")
+        return _ticker.history(start=start)
+
+    def history_bulk(self, tickers, start=None, end=None):
+        # one download for every ticker
+        return yf.download(
+            list(tickers),
+            start=start,
+            end=end,
+            group_by="column",
+            auto_adjust=True,
+            threads=True,
+            progress=False,
+        )
+
+    async def get_session(self):
+        # one pooled session for every call, recreated if it was closed
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.CONCURRENCY),
+                timeout=aiohttp.ClientTimeout(total=self.TIMEOUT),
+            )
+        return self.session
+
+    async def fetch_batch(self, session, semaphore, batch):
+        url = f"https://query1.finance.yahoo.com/v7/finance/quote?formatted=true&symbols={'%2c'.join(batch)}&corsDomain=finance.yahoo.com"
+        for attempt in range(self.RETRIES):
+            try:
+                async with semaphore:
+                    async with session.get(url) as response:
+                        response.raise_for_status()
+                        data = await response.json(content_type=None)
+                return data["quoteResponse"]["result"]
+            except (
+                aiohttp.ClientError,
+                asyncio.TimeoutError,
+                KeyError,
+                ValueError,
+            ) as e:
+                if attempt == self.RETRIES - 1:
+                    print(f"Quote batch failed after {self.RETRIES} attempts: {e!r}")
+                    return []
+                # back off before retrying, outside the semaphore so others can run
+                await asyncio.sleep(2**attempt)
+
+    async def quotes(self, tickers):
+        # BATCH_SIZE symbols per request, CONCURRENCY requests at a time
+        batches = [
+            tickers[i : i + self.BATCH_SIZE]
+            for i in range(0, len(tickers), self.BATCH_SIZE)
+        ]
+        session = await self.get_session()
+        semaphore = asyncio.Semaphore(self.CONCURRENCY)
+        results = await asyncio.gather(
+            *(self.fetch_batch(session, semaphore, batch) for batch in batches)
+        )
+        return [quote for result in results for quote in result]
+
+
+class LocalProvider(Provider):
+    # replays <TICKER>.pkl recordings and quotes.json from a directory, see record()
+    def __init__(self, directory, align=True):
+        self.directory = directory
+        # move each recording so its last bar is today, the commands look back from now
+        self.align = align
+        self.recordings = {}
+        self.recorded_quotes = None
+        self.lock = threading.Lock()
+
+    def _path(self, ticker):
+        return os.path.join(self.directory, f"{ticker.upper()}.pkl")
+
+    def has(self, ticker):
+        return os.path.exists(self._path(ticker))
+
+    def _recording(self, ticker):
+        with self.lock:
+            if ticker not in self.recordings:
+                with open(self._path(ticker), "rb") as f:
+                    recorded = pickle.load(f)
+                hist = recorded["history"]
+                if self.align and not hist.empty:
+                    today = pd.Timestamp.now(tz=hist.index.tz).normalize()
+                    hist.index = hist.index + (today - hist.index[-1].normalize())
+                self.recordings[ticker] = recorded
+            return self.recordings[ticker]
+
+    def get(self, ticker, field):
+        return copy.deepcopy(self._recording(ticker)[field])
+
+    def history(self, ticker, start=None):
+        hist = self._recording(ticker)["history"]
+        if start is not None:
+            start = pd.Timestamp(start)
+            if start.tzinfo is None:
+                start = start.tz_localize(hist.index.tz)
+            hist = hist[hist.index >= start]
+        return hist.copy()
+
+    def history_bulk(self, tickers, start=None, end=None):
+        # tickers without a recording are left out, like failed downloads
+        frames = {}
+        for ticker in tickers:
+            if self.has(ticker):
+                hist = self._recording(ticker)["history"]
+                frames[ticker] = hist.set_axis(hist.index.tz_localize(None))
+        if not frames:
+            return pd.DataFrame()
+        hist = pd.concat(frames, axis=1).swaplevel(axis=1).sort_index(axis=1)
+        if start is not None:
+            hist = hist[hist.index >= pd.Timestamp(start)]
+        if end is not None:
+            hist = hist[hist.index < pd.Timestamp(end)]
+        return hist
+
+    def quoted(self):
+        # {symbol: quote} of the recorded quotes
+        with self.lock:
+            if self.recorded_quotes is None:
+                with open(os.path.join(self.directory, "quotes.json")) as f:
+                    quotes = json.load(f)
+                self.recorded_quotes = {quote["symbol"]: quote for quote in quotes}
+            return self.recorded_quotes
+
+    async def quotes(self, tickers):
+        quoted = self.quoted()
+        return [quoted[symbol] for symbol in tickers if symbol in quoted]
+
+    def record(self, source, tickers, fields=tuple(TTLS)):
+        # save what source returns for tickers, for this provider to replay
+        os.makedirs(self.directory, exist_ok=True)
+        for ticker in tickers:
+            recorded = {"history": source.history(ticker)}
+            for field in fields:
+                try:
+                    recorded[field] = source.get(ticker, field)
+                except Exception as e:
+                    print(f"{ticker}.{field} failed: {e!r}")
+                    recorded[field] = None
+            with open(self._path(ticker), "wb") as f:
+                pickle.dump(recorded, f)
+        with self.lock:
+            self.recordings.clear()
+
+    def record_quotes(self, quotes):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, "quotes.json"), "w") as f:
+            json.dump(quotes, f)
+        with self.lock:
+            self.recorded_quotes = None
+
+
+class CachingProvider(Provider):
+    # serves fields and bulk history from a TTLCache, everything else goes to source
+    def __init__(self, source, cache=metadata, ttls=TTLS):
+        self.source = source
+        self.cache = cache
+        self.ttls = ttls
+
+    def get(self, ticker, field):
+        key = ("get", ticker, field)
+        value = self.cache.get(key, name=field, default=MISSING)
+        if value is MISSING:
+            with metrics.timer("fetch_seconds", call="get", field=field):
+                value = self.source.get(ticker, field)
+            self.cache.put(key, value, self.ttls.get(field, HOUR))
+        return value
+
+    def fields(self, tickers, field):
+        # only the tickers that aren't cached are fetched, in one bulk call
+        found, missing = {}, []
+        for ticker in tickers:
+            value = self.cache.get(("get", ticker, field), name=field, default=MISSING)
+            if value is MISSING:
+                missing.append(ticker)
+            else:
+                found[ticker] = value
+        if missing:
+            with metrics.timer("fetch_seconds", call="fields", field=field):
+                fetched = self.source.fields(missing, field)
+            for ticker, value in fetched.items():
+                self.cache.put(
+                    ("get", ticker, field), value, self.ttls.get(field, HOUR)
+                )
+            found.update(fetched)
+        return found
+
+    def history(self, ticker, start=None):
+        # the history store keeps these already
+        with metrics.timer("fetch_seconds", call="history", field="history"):
+            return self.source.history(ticker, start)
+
+    def history_bulk(self, tickers, start=None, end=None):
+        # daily bars, so the key only needs the days
+        days = [
+            None if day is None else str(pd.Timestamp(day).date())
+            for day in (start, end)
+        ]
+        key = ("history_bulk", tuple(tickers), *days)
+        hist = self.cache.get(key, name="history_bulk", default=MISSING)
+        if hist is MISSING:
+            with metrics.timer("fetch_seconds", call="history_bulk", field="history"):
+                hist = self.source.history_bulk(tickers, start, end)
+            self.cache.put(key, hist, HISTORY_BULK_TTL)
+        return hist
+
+    async def quotes(self, tickers):
+        # live by definition
+        with metrics.timer("fetch_seconds", call="quotes", field="quotes"):
+            return await self.source.quotes(tickers)
+
+
+def source():
+    if CONFIG.PROVIDER == "local":
+        return LocalProvider(CONFIG.BENCH_FIXTURES)
+    return YFinanceProvider()
+
+
+def current():
+    global provider
+    with _provider_lock:
+        if provider is None:
+            provider = CachingProvider(source())
+        return provider
+
+
+def use(new):
+    # swap the provider, e.g. for a replay in tests and benchmarks
+    global provider
+    with _provider_lock:
+        provider = new
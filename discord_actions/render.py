@@ -0,0 +1,97 @@
+"""
+Chart rendering without the pyplot state machine.
+
+Every chart is drawn on its own Figure with an Agg canvas and returned as PNG
+bytes, so renders never share state and run in parallel in a process pool.
+Renderers take plain data (arrays, pandas objects) so they can be pickled.
+"""
+
+import multiprocessing
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+sys.path.append("..")
+import config as CONFIG
+import discord_actions.metrics as metrics
+
+pool = None
+_pool_lock = threading.Lock()
+# set in worker processes, which render in place instead of using the pool
+INLINE = False
+
+
+def get_pool():
+    global pool
+    with _pool_lock:
+        if pool is None:
+            # spawn, forking the threaded bot process is not safe
+            pool = ProcessPoolExecutor(
+                max_workers=CONFIG.RENDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return pool
+
+
+def submit(renderer, *args, **kwargs):
+    return get_pool().submit(renderer, *args, **kwargs)
+
+
+def draw(renderer, *args, **kwargs):
+    # blocking render, for code already running in an executor
+    with metrics.timer("render_seconds", renderer=renderer.__name__):
+        if INLINE:
+            return renderer(*args, **kwargs)
+        return submit(renderer, *args, **kwargs).result()
+
+
+def _figure():
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot()
+
+
+def _png(fig):
+    buffer = BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+def line_chart(lines, title, xlabel=None, ylabel=None, labels=None, bands=()):
+    # lines is a list of (x, y) pairs, a 2D y draws one line per column;
+    # bands is a list of (line index, x, low, high) shaded in that line's color
+    fig, ax = _figure()
+    drawn = []
+    for i, (x, y) in enumerate(lines):
+        drawn.append(ax.plot(x, y, label=labels[i] if labels else None))
+    for i, x, low, high in bands:
+        ax.fill_between(x, low, high, color=drawn[i][0].get_color(), alpha=0.15)
+    ax.set_title(title)
+    if xlabel:
+        ax.set_xlabel(xlabel)
+    if ylabel:
+        ax.set_ylabel(ylabel)
+    if labels:
+        ax.legend()
+    ax.grid()
+    return _png(fig)
+
+
+def frame_chart(df, title=None):
+    # same chart as df.plot(), drawn on a private figure
+    fig, ax = _figure()
+    df.plot(ax=ax, title=title)
+    return _png(fig)
+
+
+def pie_chart(values, labels, title):
+    fig, ax = _figure()
+    ax.pie(values, labels=labels, autopct="%1.1f%%", startangle=90)
+    ax.axis("equal")  # Equal aspect ratio ensures that pie is drawn as a circle.
+    ax.set_title(title)
+    fig.tight_layout()
+    return _png(fig)
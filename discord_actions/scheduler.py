@@ -0,0 +1,181 @@
+"""
+Scheduler for the bot's blocking work.
+
+I/O-bound calls (yfinance fetches) run on a thread pool and CPU-bound ones
+(forecast fits, simulations) on a process pool, so fits can't starve fetches
+of threads or hold the GIL. Each pool sits behind a bounded priority queue;
+when a queue is full, run() raises Busy straight away instead of waiting.
+"""
+
+import asyncio
+import functools
+import itertools
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+sys.path.append("..")
+import config as CONFIG
+import discord_actions.metrics as metrics
+import discord_actions.profiler as profiler
+
+# lower numbers run first
+HIGH, NORMAL, LOW = 0, 1, 2
+
+# modules whose functions are CPU-bound and go to the process pool
+CPU_MODULES = {"algorithms.montecarlo", "algorithms.singleline"}
+
+
+class Busy(Exception):
+    pass
+
+
+def _init_cpu_worker():
+    # charts drawn inside a worker render in place, not in another pool
+    import discord_actions.render as render
+
+    render.INLINE = True
+
+
+class Lane:
+    def __init__(self, name, make_executor, workers, queue_size, remote=False):
+        self.name = name
+        self.make_executor = make_executor
+        # calls run in other processes, their metrics are shipped back
+        self.remote = remote
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = None
+        self.queue = None
+        self.running = 0
+        self.counter = itertools.count()
+
+    def start(self):
+        # the queue and dispatchers belong to the running loop, so start lazily
+        self.executor = self.make_executor(self.workers)
+        self.queue = asyncio.PriorityQueue(self.queue_size)
+        for _ in range(self.workers):
+            asyncio.get_event_loop().create_task(self._dispatch())
+
+    def depth(self):
+        return self.queue.qsize() if self.queue else 0
+
+    async def submit(self, func, priority=NORMAL, name=None):
+        if self.queue is None:
+            self.start()
+        future = asyncio.get_event_loop().create_future()
+        try:
+            # the counter keeps equal priorities first in, first out
+            self.queue.put_nowait(
+                (priority, next(self.counter), func, future, time.perf_counter(), name)
+            )
+        except asyncio.QueueFull:
+            raise Busy(f"{self.name} queue is full")
+        return await future
+
+    def _replace(self, broken):
+        # a worker that died (out of memory, segfault) breaks its whole pool for
+        # good; the calls it was running fail, the next ones get a new pool
+        if self.executor is broken:
+            print(f"{self.name} pool broke, starting a new one")
+            self.executor = self.make_executor(self.workers)
+            broken.shutdown(wait=False, cancel_futures=True)
+
+    async def _dispatch(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            _, _, func, future, queued, name = await self.queue.get()
+            if future.cancelled():
+                continue
+            started = time.perf_counter()
+            metrics.observe("queue_wait_seconds", started - queued, lane=self.name)
+            self.running += 1
+            executor = self.executor
+            try:
+                if self.remote:
+                    outcome = await loop.run_in_executor(
+                        executor, functools.partial(metrics.measured, func)
+                    )
+                    result = metrics.merge(*outcome)
+                else:
+                    result = await loop.run_in_executor(executor, func)
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    self._replace(executor)
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.running -= 1
+                metrics.observe(
+                    "call_seconds",
+                    time.perf_counter() - started,
+                    lane=self.name,
+                    function=name,
+                )
+
+
+io = Lane(
+    "io",
+    lambda workers: ThreadPoolExecutor(workers, thread_name_prefix="io"),
+    CONFIG.IO_WORKERS,
+    CONFIG.IO_QUEUE,
+)
+cpu = Lane(
+    "cpu",
+    lambda workers: ProcessPoolExecutor(
+        workers,
+        # spawn, forking the threaded bot process is not safe
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_cpu_worker,
+    ),
+    CONFIG.CPU_WORKERS,
+    CONFIG.CPU_QUEUE,
+    remote=True,
+)
+
+
+metrics.collector(
+    "executor_queue_depth",
+    "Calls waiting in each executor lane",
+    lambda: {(("lane", lane.name),): lane.depth() for lane in (io, cpu)},
+)
+metrics.collector(
+    "executor_running",
+    "Calls running in each executor lane",
+    lambda: {(("lane", lane.name),): lane.running for lane in (io, cpu)},
+)
+
+
+def lane_for(fn):
+    return cpu if fn.__module__ in CPU_MODULES else io
+
+
+def _call(fn, *args, **kwargs):
+    func = functools.partial(fn, *args, **kwargs)
+    prefix = profiler.active.get()
+    if prefix is not None:
+        # sampled in whichever thread or process ends up running it
+        func = functools.partial(profiler.call, prefix, func)
+    return func
+
+
+async def run(fn, *args, **kwargs):
+    # queue fn(*args, **kwargs) on its lane, at its configured priority
+    priority = CONFIG.PRIORITIES.get(fn.__name__, NORMAL)
+    lane = lane_for(fn)
+    prepare = getattr(fn, "prepare", None)
+    if prepare is not None and lane is cpu:
+        # fn.prepare takes fn's arguments and does its fetching, here on the I/O
+        # lane, so the process pool only gets the data and never waits on the network
+        fetched = await io.submit(
+            _call(prepare, *args, **kwargs), priority, metrics.function_name(prepare)
+        )
+        kwargs = dict(kwargs, **fetched)
+    return await lane.submit(
+        _call(fn, *args, **kwargs), priority, metrics.function_name(fn)
+    )
@@ -0,0 +1,107 @@
+"""
+Local OHLCV history store.
+
+Each ticker's full daily history is kept in one parquet file under
+CONFIG.HISTORY_DIR. Reads are served from disk; only the bars after the last
+stored one are downloaded, at most once every CONFIG.HISTORY_REFRESH seconds.
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pandas as pd
+
+sys.path.append("..")
+import config as CONFIG
+import discord_actions.providers as providers
+
+# one lock per ticker so concurrent commands don't download the same tail twice
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _path(ticker):
+    return os.path.join(CONFIG.HISTORY_DIR, f"{ticker.upper()}.parquet")
+
+
+def _lock(ticker):
+    with _locks_lock:
+        return _locks.setdefault(ticker.upper(), threading.Lock())
+
+
+def _localize(ts, index):
+    # yfinance indexes are tz-aware, the commands pass naive timestamps
+    ts = pd.Timestamp(ts)
+    if index.tz is not None and ts.tz is None:
+        return ts.tz_localize(index.tz)
+    if index.tz is None and ts.tz is not None:
+        return ts.tz_convert(None)
+    return ts
+
+
+def load(ticker, columns=None):
+    path = _path(ticker)
+    if not os.path.exists(path):
+        return None
+    return pd.read_parquet(path, columns=columns)
+
+
+def save(ticker, hist):
+    os.makedirs(CONFIG.HISTORY_DIR, exist_ok=True)
+    path = _path(ticker)
+    # write to a temporary file first so readers never see a partial file
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    hist.to_parquet(tmp)
+    os.replace(tmp, path)
+
+
+def is_fresh(ticker):
+    path = _path(ticker)
+    if not os.path.exists(path):
+        return False
+    return time.time() - os.path.getmtime(path) < CONFIG.HISTORY_REFRESH
+
+
+def update(ticker):
+    with _lock(ticker):
+        hist = load(ticker)
+        if hist is not None and is_fresh(ticker):
+            return hist
+
+        provider = providers.current()
+        if hist is None or hist.empty:
+            hist = provider.history(ticker)
+        else:
+            # start at the last stored bar, it may have been a partial intraday bar
+            tail = provider.history(ticker, start=hist.index[-1])
+            actions = tail.reindex(columns=["Dividends", "Stock Splits"]).fillna(0)
+            if (actions.iloc[1:] != 0).to_numpy().any():
+                # a new dividend or split re-adjusts every past price
+                hist = provider.history(ticker)
+            elif not tail.empty:
+                hist = pd.concat([hist, tail])
+                hist = hist[~hist.index.duplicated(keep="last")].sort_index()
+
+        if hist.empty:
+            return hist
+        save(ticker, hist)
+        return hist
+
+
+def get_history(ticker, start=None, end=None, columns=None):
+    if columns is not None and is_fresh(ticker):
+        # nothing to download, read just the requested columns
+        hist = load(ticker, columns)
+    else:
+        hist = update(ticker)
+        if columns is not None and not hist.empty:
+            hist = hist[columns]
+    if hist.empty:
+        return hist
+    if start is not None:
+        hist = hist[hist.index >= _localize(start, hist.index)]
+    if end is not None:
+        hist = hist[hist.index < _localize(end, hist.index)]
+    return hist
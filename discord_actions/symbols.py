@@ -0,0 +1,257 @@
+"""
+Symbol directory built from nasdaqtraded.txt.
+
+ftp://ftp.nasdaqtrader.com/symboldirectory/nasdaqtraded.txt is checked at most
+once a day and only downloaded again when its modification time changed. The
+parsed columns are kept in a compact .npz index that loads in milliseconds, and
+the watchlist, the movers loop and the bot's ticker validation all read it.
+"""
+
+import difflib
+import ftplib
+import os
+import re
+import string
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append("..")
+import config as CONFIG
+
+FTP_HOST = "ftp.nasdaqtrader.com"
+FTP_DIR = "symboldirectory"
+FTP_FILE = "nasdaqtraded.txt"
+DAY = 24 * 60 * 60
+
+# column name -> column in nasdaqtraded.txt
+COLUMNS = {
+    "symbol": "Symbol",
+    "name": "Security Name",
+    "exchange": "Listing Exchange",
+    "etf": "ETF",
+    "test": "Test Issue",
+}
+
+WORD = re.compile(r"[a-z0-9]+")
+
+directory = None
+# symbols sorted for binary search, with the directory row of each
+_sorted = np.array([], dtype=str)
+_rows = np.array([], dtype=int)
+# every word of every security name sorted, with the row it came from
+_tokens = np.array([], dtype=str)
+_token_rows = np.array([], dtype=int)
+# watchlist position of each symbol, tickers.txt is ordered by market cap
+_popular = None
+_lock = threading.Lock()
+
+
+def _parse(path, version):
+    # the last row is the "File Creation Time" footer
+    df = pd.read_csv(path, sep="|", dtype=str, keep_default_na=False)[:-1]
+    return {
+        "symbol": df[COLUMNS["symbol"]].to_numpy(dtype=str),
+        "name": df[COLUMNS["name"]].str.strip().to_numpy(dtype=str),
+        "exchange": df[COLUMNS["exchange"]].to_numpy(dtype=str),
+        "etf": (df[COLUMNS["etf"]] == "Y").to_numpy(),
+        "test": (df[COLUMNS["test"]] == "Y").to_numpy(),
+        "version": np.array(version),
+        "checked": np.array(time.time()),
+    }
+
+
+def _save(index):
+    os.makedirs(os.path.dirname(CONFIG.SYMBOLS_INDEX) or ".", exist_ok=True)
+    tmp = f"{CONFIG.SYMBOLS_INDEX}.tmp.npz"
+    np.savez(tmp, **index)
+    os.replace(tmp, CONFIG.SYMBOLS_INDEX)
+
+
+def _set(index):
+    global directory, _sorted, _rows, _tokens, _token_rows
+    rows = np.argsort(index["symbol"], kind="stable")
+    words, word_rows = [], []
+    for row, name in enumerate(index["name"].tolist()):
+        for word in set(WORD.findall(name.lower())):
+            words.append(word)
+            word_rows.append(row)
+    order = np.argsort(words, kind="stable")
+    _sorted, _rows = index["symbol"][rows], rows
+    _tokens, _token_rows = np.array(words)[order], np.array(word_rows)[order]
+    directory = index
+
+
+def load():
+    # never touches the network, refresh() does that
+    with _lock:
+        if directory is None:
+            if os.path.exists(CONFIG.SYMBOLS_INDEX):
+                with np.load(CONFIG.SYMBOLS_INDEX) as index:
+                    _set({key: index[key] for key in index.files})
+            elif os.path.exists(CONFIG.SYMBOLS_FILE):
+                index = _parse(CONFIG.SYMBOLS_FILE, "")
+                # an index built from the bundled file is checked on the next refresh
+                index["checked"] = np.array(0.0)
+                _save(index)
+                _set(index)
+        return directory
+
+
+def _download(ftp):
+    tmp = f"{CONFIG.SYMBOLS_FILE}.tmp"
+    with open(tmp, "wb") as f:
+        ftp.retrbinary(f"RETR {FTP_FILE}", f.write)
+    os.replace(tmp, CONFIG.SYMBOLS_FILE)
+
+
+def refresh(force=False):
+    index = load()
+    if index is not None and not force and time.time() - index["checked"] < DAY:
+        return index
+
+    try:
+        ftp = ftplib.FTP(FTP_HOST, timeout=60)
+        ftp.login()
+        ftp.cwd(FTP_DIR)
+        # "213 YYYYMMDDHHMMSS", only download when the file changed
+        version = ftp.sendcmd(f"MDTM {FTP_FILE}").split()[-1]
+        if index is None or version != str(index["version"]):
+            _download(ftp)
+            index = _parse(CONFIG.SYMBOLS_FILE, version)
+        ftp.quit()
+    except ftplib.all_errors as e:
+        print(f"Symbol directory refresh failed: {e!r}")
+        if index is None:
+            return None
+
+    index = dict(index, checked=np.array(time.time()))
+    with _lock:
+        _save(index)
+        _set(index)
+    return index
+
+
+def normalize(ticker):
+    # yahoo writes share classes as BRK-B, the directory as BRK.B
+    return ticker.strip().upper().replace("-", ".")
+
+
+def _prefix_range(array, prefix):
+    # [lo, hi) of the entries of a sorted array that start with prefix
+    lo = np.searchsorted(array, prefix, "left")
+    hi = np.searchsorted(array, prefix + "\uffff", "left")
+    return lo, hi
+
+
+def _find(symbol):
+    # directory row of symbol, or None
+    i = np.searchsorted(_sorted, symbol)
+    if i < len(_sorted) and _sorted[i] == symbol:
+        return _rows[i]
+    return None
+
+
+def is_known(ticker):
+    if load() is None:
+        # without a directory there's nothing to validate against
+        return True
+    # indices (^GSPC), currencies (EUR=X) and foreign listings (SHOP.TO) aren't in it
+    if any(char in ticker for char in "^=."):
+        return True
+    if _find(normalize(ticker)) is not None:
+        return True
+    # neither are crypto pairs (BTC-USD), only share classes (BRK-B) have short suffixes
+    base, dash, suffix = ticker.strip().rpartition("-")
+    return bool(dash and base and len(suffix) > 2)
+
+
+def _matches(rows, limit):
+    # (symbol, name) for each row once, in order, without test issues
+    seen = set()
+    matches = []
+    for row in rows:
+        if row in seen or directory["test"][row]:
+            continue
+        seen.add(row)
+        matches.append((str(directory["symbol"][row]), str(directory["name"][row])))
+        if len(matches) == limit:
+            break
+    return matches
+
+
+def search(query, limit=25):
+    # symbols starting with the query, then names with a word starting with each query word
+    if load() is None or not query.strip():
+        return []
+    lo, hi = _prefix_range(_sorted, normalize(query))
+    rows = _rows[lo:hi].tolist()
+
+    named = None
+    for word in WORD.findall(query.lower()):
+        lo, hi = _prefix_range(_tokens, word)
+        found = set(_token_rows[lo:hi].tolist())
+        named = found if named is None else named & found
+    # the watchlist's most valuable companies first, like suggest()
+    rank = _popularity()
+    rows += sorted(
+        named or (),
+        key=lambda row: (rank.get(str(directory["symbol"][row]), len(rank)), row),
+    )
+    return _matches(rows, limit)
+
+
+def _edits(symbol):
+    # every string one typo away: swapped, missing, wrong or extra letter
+    splits = [(symbol[:i], symbol[i:]) for i in range(len(symbol) + 1)]
+    letters = string.ascii_uppercase
+    return (
+        [a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1]
+        + [a + b[1:] for a, b in splits if b]
+        + [a + c + b[1:] for a, b in splits if b for c in letters]
+        + [a + c + b for a, b in splits for c in letters]
+    )
+
+
+def _popularity():
+    global _popular
+    if _popular is None:
+        try:
+            with open(CONFIG.WATCHLIST) as f:
+                watchlist = [normalize(ticker) for ticker in f.read().split()]
+        except OSError:
+            watchlist = []
+        _popular = {symbol: rank for rank, symbol in enumerate(watchlist)}
+    return _popular
+
+
+def suggest(ticker, limit=3):
+    # "did you mean" candidates: listed symbols one typo away (APPL -> AAPL),
+    # the most valuable first, then similar symbols, then company name matches
+    if load() is None:
+        return []
+    symbol = normalize(ticker)
+    rank = _popularity()
+    near = [edit for edit in dict.fromkeys(_edits(symbol)) if edit != symbol]
+    near = sorted(
+        (edit for edit in near if _find(edit) is not None),
+        key=lambda edit: rank.get(edit, len(rank)),
+    )
+    near += difflib.get_close_matches(symbol, _sorted.tolist(), n=limit, cutoff=0.6)
+    matches = _matches([_find(edit) for edit in near], limit)
+    if len(matches) < limit:
+        matches += [m for m in search(ticker, limit) if m not in matches]
+    return matches[:limit]
+
+
+def movers_universe():
+    index = load()
+    if index is None:
+        return []
+    symbols = index["symbol"]
+    # skip test issues and symbols the quote API can't take (preferreds, units, ...)
+    special = (np.char.find(symbols, ".") >= 0) | (np.char.find(symbols, "$") >= 0)
+    return symbols[~(special | index["test"])].tolist()
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import algorithms.montecarlo as mc
+
+PRICE, AVG, STDEV, DAYS, SIMS, SEED = 100.0, 0.001, 0.02, 7, 20000, 7
+
+
+def test_quantiles_interpolate_within_a_bin():
+    # ten equal bins over [0, 10): the q quantile is 10 q
+    counts = np.ones((1, 10))
+    for q in (0.05, 0.25, 0.5, 0.95):
+        value, _, _ = mc._quantiles(counts, np.array([0.0]), np.array([1.0]), q)
+        assert value[0] == pytest.approx(10 * q)
+
+
+def test_quantiles_skip_empty_bins():
+    counts = np.array([[0.0, 0.0, 4.0, 0.0, 4.0]])
+    value, i, _ = mc._quantiles(counts, np.array([0.0]), np.array([1.0]), 0.5)
+    assert i[0] == 2
+    assert value[0] == pytest.approx(3.0)
+
+
+def test_quantiles_per_day():
+    counts = np.array([[1.0, 1.0], [1.0, 3.0]])
+    value, _, _ = mc._quantiles(counts, np.zeros(2), np.ones(2), 0.5)
+    assert value == pytest.approx([1.0, 1 + 1 / 3])
+
+
+@pytest.fixture(scope="module")
+def paths():
+    # stream draws a single chunk here, the same paths simulate draws
+    assert SIMS * DAYS <= mc.CHUNK_ELEMENTS
+    return mc.simulate(PRICE, AVG, STDEV, DAYS, SIMS, SEED)
+
+
+@pytest.fixture(scope="module")
+def risk():
+    return mc.stream(PRICE, AVG, STDEV, DAYS, SIMS, SEED)
+
+
+def test_bands_match_the_paths(paths, risk):
+    for p, band in risk["bands"].items():
+        assert band[0] == PRICE
+        assert band[1:] == pytest.approx(
+            np.percentile(paths[:, 1:], p, axis=0), rel=1e-3
+        )
+
+
+def test_tail_risk_matches_the_paths(paths, risk):
+    end = np.sort(paths[:, -1])
+    tail = end[: int(round((1 - mc.LEVEL) * SIMS))]
+    assert risk["var"] == pytest.approx(1 - tail[-1] / PRICE, abs=1e-3)
+    assert risk["cvar"] == pytest.approx(1 - tail.mean() / PRICE, abs=1e-3)
+    assert risk["cvar"] > risk["var"] > 0
+
+
+def test_estimates_match_the_paths(paths, risk):
+    end = paths[:, -1]
+    assert risk["close"][0] == pytest.approx(end.mean())
+    assert risk["increase"][0] == pytest.approx((end > PRICE).mean())
+    # the expected change of the model is (1 + avg) ** days - 1
+    change, se = risk["change"]
+    assert abs(change - ((1 + AVG) ** DAYS - 1)) < 4 * se
+
+
+def test_chunks_dont_change_the_result(monkeypatch, risk):
+    # many small chunks sample other paths, but the same distribution
+    monkeypatch.setattr(mc, "CHUNK_ELEMENTS", 1000 * DAYS)
+    chunked = mc.stream(PRICE, AVG, STDEV, DAYS, SIMS, SEED)
+    assert chunked["bands"][50] == pytest.approx(risk["bands"][50], rel=2e-3)
+    assert chunked["var"] == pytest.approx(risk["var"], abs=5e-3)
+    assert chunked["cvar"] == pytest.approx(risk["cvar"], abs=5e-3)
+    assert chunked["close"][1] == pytest.approx(risk["close"][1], rel=0.1)
@@ -0,0 +1,71 @@
+import pandas as pd
+import pytest
+
+import config as CONFIG
+import algorithms.movers as mv
+
+
+@pytest.fixture(autouse=True)
+def state(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG, "MOVERS_STATE", str(tmp_path / "movers_state.json"))
+    monkeypatch.setattr(CONFIG, "THRESHOLD", 45.0)
+    monkeypatch.setattr(CONFIG, "REALERT_STEP", 10.0)
+
+
+def quotes(**changes):
+    return pd.DataFrame(
+        {"symbol": list(changes), "change": [float(c) for c in changes.values()]}
+    )
+
+
+def alerted(frame):
+    return list(frame["symbol"])
+
+
+def test_alerts_on_crossing_the_threshold():
+    assert alerted(mv.find_alerts(quotes(AAA=50, BBB=10))) == ["AAA"]
+
+
+def test_sorted_by_move():
+    assert alerted(mv.find_alerts(quotes(AAA=50, BBB=80, CCC=60))) == [
+        "BBB",
+        "CCC",
+        "AAA",
+    ]
+
+
+def test_no_repeat_until_realert_step():
+    mv.find_alerts(quotes(AAA=50))
+    assert alerted(mv.find_alerts(quotes(AAA=55))) == []
+    assert alerted(mv.find_alerts(quotes(AAA=59.9))) == []
+    assert alerted(mv.find_alerts(quotes(AAA=60))) == ["AAA"]
+    # the step is counted from the last alert, not the first
+    assert alerted(mv.find_alerts(quotes(AAA=65))) == []
+    assert alerted(mv.find_alerts(quotes(AAA=70))) == ["AAA"]
+
+
+def test_falling_back_resets():
+    mv.find_alerts(quotes(AAA=50))
+    assert alerted(mv.find_alerts(quotes(AAA=30))) == []
+    assert alerted(mv.find_alerts(quotes(AAA=46))) == ["AAA"]
+
+
+def test_missing_symbol_keeps_its_alert():
+    # a quote missing from one sweep isn't a fall back under the threshold
+    mv.find_alerts(quotes(AAA=50))
+    mv.find_alerts(quotes(BBB=10))
+    assert alerted(mv.find_alerts(quotes(AAA=52))) == []
+
+
+def test_new_day_starts_over():
+    mv.find_alerts(quotes(AAA=50))
+    state = mv.load_state()
+    state["date"] = "2000-01-01"
+    mv.save_state(state)
+    assert alerted(mv.find_alerts(quotes(AAA=50))) == ["AAA"]
+
+
+def test_state_survives_a_bad_file():
+    with open(CONFIG.MOVERS_STATE, "w") as f:
+        f.write("{not json")
+    assert alerted(mv.find_alerts(quotes(AAA=50))) == ["AAA"]
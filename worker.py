@@ -0,0 +1,60 @@
+"""
+Job worker for the bot's distributed mode (CONFIG.WORKER_MODE = True).
+
+Claims queued ac.*/mc.*/sl.* calls from the job database, runs them and
+writes the results back for the bot to send. Start as many as needed, on
+the machine that holds the database (SQLite can't be shared across hosts).
+JOBS_SECRET must be set, in the environment or .env, to the bot's value:
+
+    python worker.py
+"""
+
+import importlib
+import os
+import socket
+import time
+import traceback
+
+from dotenv import load_dotenv
+
+import config as CONFIG
+import discord_actions.jobs as jobs
+import discord_actions.render as render
+
+
+def run(job):
+    # only the allowlisted functions, arguments are plain JSON
+    if job["command"] not in jobs.FUNCTIONS:
+        raise ValueError(f"{job['command']} can't be run by a worker")
+    module, function = job["command"].split(":")
+    fn = getattr(importlib.import_module(module), function)
+    args, kwargs = jobs.loads_args(job["args"])
+    return fn(*args, **kwargs)
+
+
+def main():
+    load_dotenv()
+    # results can't be signed without it, so don't claim anything
+    jobs.sign(None)
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    # this process is the compute, charts don't need a pool of their own
+    render.INLINE = True
+    importlib.import_module("algorithms.singleline").warmup()
+    print(f"Worker {name} waiting for jobs...")
+
+    while True:
+        job = jobs.claim(name)
+        if job is None:
+            time.sleep(CONFIG.JOBS_POLL)
+            continue
+        try:
+            with jobs.lease(job["id"], name):
+                result = run(job)
+        except Exception:
+            jobs.fail(job["id"], traceback.format_exc())
+        else:
+            jobs.finish(job["id"], result)
+
+
+if __name__ == "__main__":
+    main()